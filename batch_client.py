@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""Command line client for running batches of consultations through the LegifAI API.
+
+The input is a JSONL file with one `{"session_id": ..., "human_input": ...}` record per
+line (an optional `record_id` may be given, otherwise the line number is used). Results
+are appended to the output JSONL file as they stream back from the server. Records that
+already have a successful result in the output file are skipped, so an interrupted run
+can be resumed by running the same command again. Once a turn fails, the later turns
+of its session are skipped, so the resumed run replays them in order.
+
+The batch endpoint requires the admin key, read from `ADMIN_API_KEY` or `--admin-key`.
+
+Usage:
+    python batch_client.py consultations.jsonl results.jsonl --concurrency 8
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import requests
+
+# Configuration
+API_BASE_URL = "http://localhost:8000"  # Change to your deployed URL
+
+
+def load_records(input_path):
+    """Load the batch records from a JSONL file."""
+    records = []
+    with open(input_path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            record["record_id"] = str(record.get("record_id") or line_number)
+            records.append(record)
+    return records
+
+
+def load_completed_ids(output_path):
+    """Return the IDs of records that already have a successful result."""
+    completed = set()
+    try:
+        with open(output_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    # Last line of an interrupted run
+                    continue
+                if "response" in result:
+                    completed.add(result["record_id"])
+    except FileNotFoundError:
+        pass
+    return completed
+
+
+def run_batch(records, output_path, api_base_url=API_BASE_URL, concurrency=8, request_size=200, admin_key=None):
+    """Send the records to the batch endpoint and append the results to the output file."""
+    headers = {"X-Admin-Key": admin_key} if admin_key else {}
+    succeeded = 0
+    failed = 0
+    failed_sessions = set()
+    with open(output_path, "a", encoding="utf-8") as out:
+        # Send the records in slices so an interruption only loses the slice in flight
+        for start in range(0, len(records), request_size):
+            batch = []
+            for record in records[start:start + request_size]:
+                if record["session_id"] in failed_sessions:
+                    # A turn of this session failed in an earlier slice, keep its turns in order
+                    skipped = {**record, "error": "skipped: earlier turn failed"}
+                    out.write(json.dumps(skipped, ensure_ascii=False) + "\n")
+                    failed += 1
+                else:
+                    batch.append(record)
+            if not batch:
+                continue
+
+            payload = {"records": batch, "max_concurrency": concurrency}
+            with requests.post(f"{api_base_url}/batch", json=payload, headers=headers, stream=True) as response:
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    out.write(line + "\n")
+                    out.flush()
+                    result = json.loads(line)
+                    if "response" in result:
+                        succeeded += 1
+                    else:
+                        failed += 1
+                        failed_sessions.add(result["session_id"])
+            print(f"Processed {min(start + request_size, len(records))}/{len(records)} records")
+    return succeeded, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a batch of consultations through LegifAI.")
+    parser.add_argument("input", help="JSONL file with session_id and human_input records")
+    parser.add_argument("output", help="JSONL file the results are appended to")
+    parser.add_argument("--url", default=API_BASE_URL, help="Base URL of the LegifAI API")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum concurrent consultations")
+    parser.add_argument("--request-size", type=int, default=200, help="Records sent per request (at most 500)")
+    parser.add_argument("--admin-key", default=os.getenv("ADMIN_API_KEY"), help="Admin key of the LegifAI API")
+    args = parser.parse_args()
+
+    records = load_records(args.input)
+    completed = load_completed_ids(args.output)
+    pending = [record for record in records if record["record_id"] not in completed]
+    print(f"{len(records)} records, {len(completed)} already done, {len(pending)} pending")
+
+    if not pending:
+        return 0
+
+    succeeded, failed = run_batch(pending, args.output, args.url, args.concurrency, args.request_size,
+                                  args.admin_key)
+    print(f"✅ {succeeded} succeeded, ❌ {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,13 @@
 #!/usr/bin/env python
-"""Example client for interacting with the LegifAI API."""
+"""Example client for interacting with the LegifAI API.
+
+Run with `--ws` to use the persistent WebSocket endpoint, which streams the response
+tokens and keeps the session in memory on the server between turns.
+"""
 
 import requests
 import json
+import sys
 import uuid
 
 # Configuration
@@ -39,7 +44,29 @@ def send_message(message, session_id=SESSION_ID):
         print(response.text)
         return None
 
-def example_consultation():
+def socket_url(session_id=SESSION_ID):
+    """URL of the persistent WebSocket chat endpoint for a session."""
+    ws_base_url = API_BASE_URL.replace("http", "ws", 1)
+    return f"{ws_base_url}/chat/ws?session_id={session_id}"
+
+
+def send_message_ws(socket, message):
+    """Send a message over the WebSocket, printing the response tokens as they arrive."""
+    socket.send(json.dumps({"human_input": message}))
+    print("LegifAI: ", end="", flush=True)
+    while True:
+        event = json.loads(socket.recv())
+        if event["type"] == "token":
+            print(event["content"], end="", flush=True)
+        elif event["type"] == "end":
+            print()
+            return event["response"]
+        elif event["type"] == "error":
+            print(f"\nError: {event['detail']}")
+            return None
+
+
+def example_consultation(send=send_message, streaming=False):
     """Example consultation flow."""
     print("🤖 LegifAI - Example Consultation")
     print("=" * 50)
@@ -49,8 +76,8 @@ def example_consultation():
     first_message = "¿Qué documentos necesito para crear una sociedad limitada?"
     print(f"User: {first_message}")
     
-    response1 = send_message(first_message)
-    if response1:
+    response1 = send(first_message)
+    if response1 and not streaming:
         print(f"LegifAI: {response1}")
     
     # Second interaction - answering the bot's questions
@@ -58,8 +85,8 @@ def example_consultation():
     second_message = "Queremos crear una SL con 2 socios, capital inicial de 10.000€, y actividad de consultoría tecnológica."
     print(f"User: {second_message}")
     
-    response2 = send_message(second_message)
-    if response2:
+    response2 = send(second_message)
+    if response2 and not streaming:
         print(f"LegifAI: {response2}")
     
     # Third interaction - case closure
@@ -67,8 +94,8 @@ def example_consultation():
     third_message = "Gracias por la información."
     print(f"User: {third_message}")
     
-    response3 = send_message(third_message)
-    if response3:
+    response3 = send(third_message)
+    if response3 and not streaming:
         print(f"LegifAI: {response3}")
 
 def check_api_health():
@@ -92,7 +119,15 @@ if __name__ == "__main__":
     # Check API health
     if check_api_health():
         print(f"Session ID: {SESSION_ID}")
-        example_consultation()
+        if "--ws" in sys.argv:
+            from websockets.sync.client import connect
+
+            with connect(socket_url()) as socket:
+                ready = json.loads(socket.recv())
+                print(f"🔌 WebSocket connected (turn {ready.get('turn', 0)})")
+                example_consultation(lambda message: send_message_ws(socket, message), streaming=True)
+        else:
+            example_consultation()
     else:
         print("\nPlease start the LegifAI server:")
         print("cd src && python app.py") 
\ No newline at end of file
@@ -9,19 +9,33 @@ This version includes both the API endpoints and a Gradio web interface.
 """
 import re
 import os
+import hmac
+import json
 from pathlib import Path
-from typing import Callable, Union
+from typing import Callable, List, Optional, Union
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import RedirectResponse
-from langchain_community.chat_message_histories import FileChatMessageHistory
+from fastapi import FastAPI, Header, HTTPException, WebSocket
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import RedirectResponse, StreamingResponse
 from langchain_core.chat_history import BaseChatMessageHistory
 from langserve import add_routes
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 import gradio as gr
 
-from rag_chain import create_rag_chain_with_history
+from rag_chain import (
+    create_context_retriever,
+    create_generation_chain,
+    create_history_summarizer,
+    create_rag_chain_with_history,
+)
+from vector_store import init_vector_store
+from article_index import ArticleIndex
+from prefetch import PrefetchCache
+from batch import BatchRequest, run_batch
+from chat_socket import ChatSocketSession, serve_chat_socket
+from history_compaction import CompactingChatMessageHistory, HistoryCompactor
+from session_lifecycle import SessionArchive, SessionLifecycleManager
 from legifai_gradio import create_gradio_app
 
 # Load environment variables
@@ -61,13 +75,37 @@ def _is_valid_identifier(value: str) -> bool:
     return bool(valid_characters.match(value))
 
 
+def _check_session_id(session_id: str) -> None:
+    """Raise an HTTP 400 error if the session ID is not in a valid format."""
+    if not _is_valid_identifier(session_id):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Session ID `{session_id}` is not in a valid format. "
+            "Session ID must only contain alphanumeric characters, "
+            "hyphens, and underscores.",
+        )
+
+
+def _check_admin_key(x_admin_key: Optional[str]) -> None:
+    """Raise an HTTP error unless the request carries the configured admin key."""
+    admin_key = os.getenv('ADMIN_API_KEY')
+    if not admin_key:
+        raise HTTPException(status_code=503, detail="ADMIN_API_KEY is not configured")
+    if x_admin_key is None or not hmac.compare_digest(x_admin_key.encode(), admin_key.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin key")
+
+
 def create_session_factory(
     base_dir: Union[str, Path],
+    compactor: Optional[HistoryCompactor] = None,
+    lifecycle: Optional[SessionLifecycleManager] = None,
 ) -> Callable[[str], BaseChatMessageHistory]:
     """Create a session ID factory that creates session IDs from a base dir.
 
     Args:
         base_dir: Base directory to use for storing the chat histories.
+        compactor: Optional background compactor that summarizes long histories.
+        lifecycle: Optional lifecycle manager used to restore archived sessions.
 
     Returns:
         A session ID factory that creates session IDs from a base path.
@@ -76,17 +114,19 @@ def create_session_factory(
     if not base_dir_.exists():
         base_dir_.mkdir(parents=True)
 
-    def get_chat_history(session_id: str) -> FileChatMessageHistory:
+    def get_chat_history(session_id: str) -> CompactingChatMessageHistory:
         """Get a chat history from a session ID."""
-        if not _is_valid_identifier(session_id):
-            raise HTTPException(
-                status_code=400,
-                detail=f"Session ID `{session_id}` is not in a valid format. "
-                "Session ID must only contain alphanumeric characters, "
-                "hyphens, and underscores.",
-            )
+        _check_session_id(session_id)
+        if lifecycle is not None:
+            # Sessions archived after going idle are brought back transparently
+            lifecycle.restore_session(session_id)
         file_path = base_dir_ / f"{session_id}.json"
-        return FileChatMessageHistory(str(file_path))
+        return CompactingChatMessageHistory(
+            str(file_path),
+            session_id,
+            compactor,
+            restore=lifecycle.restore_session if lifecycle is not None else None,
+        )
 
     return get_chat_history
 
@@ -121,19 +161,95 @@ class OutputChat(BaseModel):
     )
 
 
+class PrefetchRequest(BaseModel):
+    """Input for the prefetch endpoint."""
+
+    session_id: str = Field(..., description="Session the draft message belongs to.")
+    text: str = Field(..., description="The draft message typed so far.")
+
+
+class OutputStructuredChat(BaseModel):
+    """Output for the structured chat endpoint. Empty fields are omitted."""
+
+    answer: Optional[str] = Field(
+        None,
+        description="The legal advice response, without the lawyer summary.",
+    )
+    citations: Optional[List[str]] = Field(
+        None,
+        description="BOE articles cited in the response.",
+        examples=[["artículo 19 de la Ley 1/2010"]]
+    )
+    questions: Optional[List[str]] = Field(
+        None,
+        description="Follow-up questions asked to the user.",
+    )
+    lawyer_summary: Optional[str] = Field(
+        None,
+        description="Technical summary for the lawyer taking the case.",
+    )
+
+
+# Summarize older turns of long sessions in the background
+history_compactor = HistoryCompactor(create_history_summarizer())
+
+# Archive idle and closed sessions out of the live history directory
+session_lifecycle = SessionLifecycleManager(
+    "chat_histories",
+    SessionArchive(os.getenv('SESSION_ARCHIVE_DIR', 'chat_archive')),
+)
+session_lifecycle.start()
+
+# Initialize the retriever from Pinecone, shared by the chat and batch endpoints
+retriever = init_vector_store()
+
+# Local index of BOE article identifiers, if it has been built
+article_index = ArticleIndex.load()
+
+# Documents retrieved speculatively while users type in the web interface
+prefetch_cache = PrefetchCache(retriever.invoke)
+
+# Session histories shared by every chat endpoint
+get_session_history = create_session_factory("chat_histories", history_compactor, session_lifecycle)
+
 # Create the RAG chain with history
 chain_with_history = create_rag_chain_with_history(
-    create_session_factory("chat_histories")
+    get_session_history,
+    retriever,
+    article_index=article_index,
+    prefetch_cache=prefetch_cache,
 ).with_types(input_type=InputChat, output_type=OutputChat)
 
 
-# Add the chat route
+# Create the structured variant of the chain, sharing the same histories
+structured_chain_with_history = create_rag_chain_with_history(
+    get_session_history,
+    retriever,
+    structured=True,
+    article_index=article_index,
+    prefetch_cache=prefetch_cache,
+).with_types(input_type=InputChat, output_type=OutputStructuredChat)
+
+
+# Retrieval and generation used directly by the WebSocket endpoint, which keeps
+# the history in memory instead of going through RunnableWithMessageHistory
+socket_context_retriever = create_context_retriever(retriever, article_index, prefetch_cache)
+socket_generation_chain = create_generation_chain()
+
+
+# Add the chat routes
 add_routes(
     app,
     chain_with_history,
     path="/chat",
 )
 
+add_routes(
+    app,
+    structured_chain_with_history,
+    path="/chat/structured",
+)
+
 # Create and mount Gradio app
 print("Creating Gradio interface...")
 gradio_app = create_gradio_app(api_base_url="")  # Empty string means same host
@@ -156,6 +272,9 @@ async def api_info():
         "interfaces": {
             "web": "/ui - Web interface (Gradio)",
             "api": "/chat - REST API endpoints",
+            "websocket": "/chat/ws?session_id=... - Persistent streaming chat",
+            "structured": "/chat/structured - Answer, citations, questions and lawyer summary as typed fields",
+            "batch": "/batch - Batch consultations (NDJSON stream)",
             "docs": "/docs - API documentation",
             "playground": "/chat/playground - Interactive API playground"
         },
@@ -172,6 +291,67 @@ async def health_check():
     return {"status": "healthy", "service": "LegifAI", "interfaces": ["web", "api"]}
 
 
+@app.websocket("/chat/ws")
+async def chat_websocket(websocket: WebSocket, session_id: str):
+    """Persistent chat endpoint that keeps the session in memory while the socket is open."""
+    if not _is_valid_identifier(session_id):
+        await websocket.close(code=1008, reason="Invalid session ID")
+        return
+    await websocket.accept()
+    history = await run_in_threadpool(get_session_history, session_id)
+    await serve_chat_socket(
+        websocket,
+        ChatSocketSession(session_id, history),
+        socket_context_retriever,
+        socket_generation_chain,
+        prefetch_cache,
+    )
+
+
+@app.post("/chat/prefetch")
+async def chat_prefetch(request: PrefetchRequest):
+    """Speculatively retrieve context for a message that is still being typed."""
+    _check_session_id(request.session_id)
+    status = prefetch_cache.prefetch(request.session_id, request.text)
+    return {"status": status}
+
+
+@app.post("/batch")
+async def chat_batch(request: BatchRequest, x_admin_key: Optional[str] = Header(default=None)):
+    """Run many consultation turns and stream the results back as NDJSON as they complete."""
+    _check_admin_key(x_admin_key)
+
+    async def stream_results():
+        async for result in run_batch(
+            chain_with_history,
+            retriever,
+            request.records,
+            max_concurrency=request.max_concurrency,
+            chunk_size=request.chunk_size,
+            article_index=article_index,
+        ):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+@app.post("/sessions/{session_id}/close")
+async def close_session(session_id: str, x_admin_key: Optional[str] = Header(default=None)):
+    """Close a consultation and move its history into the archive."""
+    _check_admin_key(x_admin_key)
+    _check_session_id(session_id)
+    archived = await run_in_threadpool(session_lifecycle.archive_session, session_id)
+    return {"session_id": session_id, "archived": archived}
+
+
+@app.get("/admin/sessions/stats")
+async def session_stats(x_admin_key: Optional[str] = Header(default=None)):
+    """Statistics about live and archived sessions and pending prefetches."""
+    _check_admin_key(x_admin_key)
+    stats = await run_in_threadpool(session_lifecycle.stats)
+    return {**stats, "prefetch": prefetch_cache.stats()}
+
+
 if __name__ == "__main__":
     import uvicorn
     
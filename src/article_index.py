@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+"""Local index of BOE article identifiers for citation-aware retrieval.
+
+The index maps (law, article, section) identifiers to the Pinecone chunks that contain
+them, together with the character offsets where the article or section starts and ends. Queries
+that reference an exact article ("artículo 19 de la Ley 1/2010") are resolved with a
+dictionary lookup, without embedding the query or searching the vector store. The index
+also provides the compact citation headers that precede each chunk in the prompt.
+
+Build it from the Pinecone index with:
+    python article_index.py build
+"""
+import json
+import os
+import re
+import sys
+import unicodedata
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from langchain_core.documents import Document
+
+DEFAULT_INDEX_PATH = os.getenv('ARTICLE_INDEX_PATH', 'article_index.json')
+
+# Metadata keys that may hold the law a chunk belongs to, in order of preference
+LAW_METADATA_KEYS = ("law", "title", "titulo", "source", "boe_id", "identificador")
+
+LAW_PATTERN = (
+    r"Ley(?:\s+Orgánica)?\s+\d+/\d{4}"
+    r"|Real\s+Decreto(?:\s+Legislativo|-ley)?\s+\d+/\d{4}"
+    r"|Código\s+(?:Civil|Penal|de\s+Comercio)"
+    r"|Constitución(?:\s+Española)?"
+    r"|Estatuto\s+de\s+los\s+Trabajadores"
+    r"|BOE-[A-Z]-\d{4}-\d+"
+)
+
+# Article headings inside a chunk, e.g. "Artículo 19. Escritura de constitución."
+ARTICLE_HEADING_PATTERN = re.compile(r"(?m)^\s*Art[íi]culo\s+(\d+(?:\s+(?:bis|ter|quater))?)\b")
+
+# Numbered sections inside an article, e.g. "2. Los socios..."
+SECTION_HEADING_PATTERN = re.compile(r"(?m)^\s*(\d+)\.\s")
+
+# Article references in a user query, e.g. "art. 19.2 de la Ley 1/2010" or "artículo 5 bis"
+ARTICLE_REFERENCE_PATTERN = re.compile(
+    r"\b(?:artículos?|articulos?|arts?\.)\s+(?P<article>\d+(?:\s+(?:bis|ter|quater)\b)?)"
+    r"(?:\.(?P<section>\d+))?"
+    rf"(?:\s+(?:de\s+la|del)\s+(?P<law>{LAW_PATTERN}))?",
+    re.IGNORECASE,
+)
+
+LAW_REFERENCE_PATTERN = re.compile(LAW_PATTERN, re.IGNORECASE)
+
+
+def normalize_law(law: str) -> str:
+    """Normalize a law identifier so different spellings share the same key."""
+    law = unicodedata.normalize("NFKD", law).encode("ascii", "ignore").decode("ascii")
+    law = " ".join(law.lower().split())
+    return law.replace("constitucion espanola", "constitucion")
+
+
+def normalize_article(article: str) -> str:
+    """Normalize an article number, e.g. "5  BIS" -> "5 bis"."""
+    return " ".join(article.lower().split())
+
+
+def _index_key(law: str, article: str, section: Optional[str] = None) -> str:
+    key = f"{normalize_law(law)}|{normalize_article(article)}"
+    return f"{key}|{section}" if section else key
+
+
+class ArticleIndex:
+    """In-memory mapping from BOE article identifiers to chunks."""
+
+    def __init__(self, entries: Dict[str, List[list]], chunks: Dict[str, dict]):
+        """
+        Args:
+            entries: `law|article[|section]` keys mapped to `[chunk_id, start, end]` spans
+            chunks: Chunk IDs mapped to their text, law and citation header
+        """
+        self.entries = entries
+        self.chunks = chunks
+        # Laws containing each article number, to resolve references without a law
+        self.laws_by_article: Dict[str, List[str]] = {}
+        for key in entries:
+            parts = key.split("|")
+            if len(parts) == 2:
+                self.laws_by_article.setdefault(parts[1], []).append(parts[0])
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_INDEX_PATH) -> Optional["ArticleIndex"]:
+        """Load the index from disk, or return None if it has not been built."""
+        if not Path(path).exists():
+            print(f"Article index not found at {path}; exact article lookups are disabled.")
+            return None
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        print(f"Loaded article index with {len(data['entries'])} entries")
+        return cls(data["entries"], data["chunks"])
+
+    def save(self, path: str = DEFAULT_INDEX_PATH) -> None:
+        """Write the index to disk."""
+        data = {"entries": self.entries, "chunks": self.chunks}
+        Path(path).write_text(json.dumps(data, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+
+    def _resolve_law(self, article: str, history: Sequence) -> Optional[str]:
+        """Find the law of an article reference that does not name one."""
+        laws = self.laws_by_article.get(article, [])
+        if len(laws) == 1:
+            return laws[0]
+        # Follow-up questions usually refer to a law cited earlier in the conversation
+        for message in reversed(history):
+            for match in LAW_REFERENCE_PATTERN.finditer(str(message.content)):
+                law = normalize_law(match.group(0))
+                if law in laws:
+                    return law
+        return None
+
+    def lookup(self, query: str, history: Sequence = ()) -> List[Document]:
+        """
+        Resolve the exact article references of a query
+
+        Args:
+            query: The user query
+            history: Previous messages, used to find the law of references like "¿y el artículo 20?"
+
+        Returns:
+            list: The chunks containing the referenced articles, empty if any reference
+                cannot be resolved (the caller should fall back to vector search)
+        """
+        docs = []
+        seen = set()
+        for match in ARTICLE_REFERENCE_PATTERN.finditer(query):
+            article = normalize_article(match.group("article"))
+            law = match.group("law") or self._resolve_law(article, history)
+            if law is None:
+                return []
+            section = match.group("section")
+            entries = self.entries.get(_index_key(law, article, section), []) if section else []
+            if not entries:
+                # The section is not numbered in the text, cite the whole article
+                section = None
+                entries = self.entries.get(_index_key(law, article), [])
+            if not entries:
+                return []
+            for chunk_id, start, *end in entries:
+                # Indexes built before end offsets were stored hold `[chunk_id, start]`
+                end = end[0] if end else None
+                if (chunk_id, start, end) in seen:
+                    continue
+                seen.add((chunk_id, start, end))
+                chunk = self.chunks[chunk_id]
+                # The text is only the referenced article or section, so is its citation
+                citation = f"{chunk['law']}, art. {article}" + (f".{section}" if section else "")
+                docs.append(Document(
+                    id=chunk_id,
+                    page_content=chunk["text"][start:end],
+                    metadata={"law": chunk["law"], "citation": citation},
+                ))
+        return docs
+
+    def header(self, doc: Document) -> str:
+        """Return the compact citation header of a retrieved chunk."""
+        if "citation" in doc.metadata:
+            return doc.metadata["citation"]
+        chunk = self.chunks.get(doc.id) if doc.id else None
+        if chunk is not None:
+            return chunk["header"]
+        return citation_header(doc.metadata, doc.page_content)
+
+
+def _chunk_law(metadata: dict) -> str:
+    """Pick the law a chunk belongs to from its metadata."""
+    for key in LAW_METADATA_KEYS:
+        value = metadata.get(key)
+        if not value:
+            continue
+        match = LAW_REFERENCE_PATTERN.search(str(value))
+        return match.group(0) if match else str(value)
+    return ""
+
+
+def citation_header(metadata: dict, text: str) -> str:
+    """Build a compact citation header, e.g. "Ley 1/2010, arts. 19, 20", from a chunk."""
+    law = _chunk_law(metadata)
+    articles = []
+    for match in ARTICLE_HEADING_PATTERN.finditer(text):
+        article = normalize_article(match.group(1))
+        if article not in articles:
+            articles.append(article)
+    if not articles:
+        return law or "BOE"
+    prefix = "art." if len(articles) == 1 else "arts."
+    references = f"{prefix} {', '.join(articles)}"
+    return f"{law}, {references}" if law else references
+
+
+def build_from_chunks(chunks) -> ArticleIndex:
+    """
+    Build the index from `(chunk_id, text, metadata)` tuples
+
+    Args:
+        chunks: Iterable of chunks as stored in the vector store
+
+    Returns:
+        ArticleIndex: The index of every article heading found in the chunks
+    """
+    entries: Dict[str, List[list]] = {}
+    stored: Dict[str, dict] = {}
+    for chunk_id, text, metadata in chunks:
+        law = _chunk_law(metadata)
+        stored[chunk_id] = {"text": text, "law": law, "header": citation_header(metadata, text)}
+        if not law:
+            continue
+        headings = list(ARTICLE_HEADING_PATTERN.finditer(text))
+        for i, heading in enumerate(headings):
+            article = heading.group(1)
+            start = heading.start()
+            end = headings[i + 1].start() if i + 1 < len(headings) else len(text)
+            entries.setdefault(_index_key(law, article), []).append([chunk_id, start, end])
+            sections = list(SECTION_HEADING_PATTERN.finditer(text, start, end))
+            for j, section in enumerate(sections):
+                section_end = sections[j + 1].start() if j + 1 < len(sections) else end
+                entries.setdefault(_index_key(law, article, section.group(1)), []).append(
+                    [chunk_id, section.start(), section_end]
+                )
+    return ArticleIndex(entries, stored)
+
+
+def iter_pinecone_chunks(text_key: str = "text", batch_size: int = 100, include_values: bool = False):
+    """
+    Yield `(chunk_id, text, metadata)` for every vector of the BOE Pinecone index
+
+    Args:
+        text_key: Metadata key holding the chunk text
+        batch_size: Number of vectors fetched per request
+        include_values: Also yield the embedding values, as a fourth element
+    """
+    from dotenv import load_dotenv
+    from pinecone import Pinecone
+
+    load_dotenv()
+    pinecone_api_key = os.getenv('PINECONE_API_KEY')
+    pinecone_index_name = os.getenv('PINECONE_INDEX_BOE')
+    if not pinecone_api_key or not pinecone_index_name:
+        raise ValueError("Pinecone API key and index name must be set")
+
+    index = Pinecone(api_key=pinecone_api_key).Index(pinecone_index_name)
+    for ids in index.list(limit=batch_size):
+        vectors = index.fetch(ids=list(ids)).vectors
+        for chunk_id, vector in vectors.items():
+            metadata = dict(vector.metadata or {})
+            text = metadata.pop(text_key, "")
+            if not text:
+                continue
+            if include_values:
+                yield chunk_id, text, metadata, vector.values
+            else:
+                yield chunk_id, text, metadata
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "build":
+        print("Usage: python article_index.py build [output_path]")
+        sys.exit(1)
+    output_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_INDEX_PATH
+    article_index = build_from_chunks(iter_pinecone_chunks())
+    article_index.save(output_path)
+    print(f"Indexed {len(article_index.entries)} article references from "
+          f"{len(article_index.chunks)} chunks into {output_path}")
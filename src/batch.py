@@ -0,0 +1,140 @@
+"""Batch consultations for offline processing of many queries.
+
+Records are `(session_id, human_input)` pairs. Turns of the same session must run in
+order, so records are processed in waves: wave N holds the N-th turn of every session
+in the batch. Each wave is split into chunks; turns citing an exact article are resolved
+through the article index, and the retrieval of the rest is grouped (one embeddings
+request per chunk) before the chunk runs through the chain with bounded concurrency.
+Results are yielded as soon as they complete. Once a turn fails, the later turns of its
+session are skipped, so a resumed run replays them in order after the failed one.
+"""
+from collections import defaultdict
+from typing import AsyncIterator, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+
+from article_index import ARTICLE_REFERENCE_PATTERN
+from vector_store import retrieve_batch
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_CHUNK_SIZE = 32
+
+# Largest batch accepted in one request, clients send bigger runs in slices
+MAX_BATCH_RECORDS = 500
+
+SKIPPED_ERROR = "skipped: earlier turn failed"
+
+
+class BatchRecord(BaseModel):
+    """A single consultation turn of a batch."""
+
+    session_id: str = Field(..., description="Session the turn belongs to.")
+    human_input: str = Field(..., description="The human input to the legal consultation system.")
+    record_id: Optional[str] = Field(
+        None,
+        description="Identifier echoed back in the result, used by clients to resume interrupted batches.",
+    )
+
+
+class BatchRequest(BaseModel):
+    """Input for the batch endpoint."""
+
+    records: List[BatchRecord] = Field(..., min_length=1, max_length=MAX_BATCH_RECORDS)
+    max_concurrency: int = Field(DEFAULT_MAX_CONCURRENCY, ge=1, le=64)
+    chunk_size: int = Field(DEFAULT_CHUNK_SIZE, ge=1, le=256)
+
+
+def split_into_waves(records: List[BatchRecord]) -> List[List[BatchRecord]]:
+    """Group records so each wave holds at most one turn per session, in input order."""
+    turns_by_session = defaultdict(int)
+    waves = []
+    for record in records:
+        turn = turns_by_session[record.session_id]
+        turns_by_session[record.session_id] += 1
+        if turn == len(waves):
+            waves.append([])
+        waves[turn].append(record)
+    return waves
+
+
+async def run_batch(
+    chain,
+    retriever,
+    records: List[BatchRecord],
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    article_index=None,
+) -> AsyncIterator[dict]:
+    """
+    Run many consultation turns through the chain
+
+    Args:
+        chain: The RAG chain with message history
+        retriever: The retriever used by the chain
+        records: The consultation turns to run
+        max_concurrency: Maximum number of chain calls running at the same time
+        chunk_size: Number of turns whose retrieval is grouped into one embeddings request
+        article_index: Optional ArticleIndex used to resolve exact article references
+
+    Yields:
+        dict: One result per record, in completion order
+    """
+    failed_sessions = set()
+    for wave in split_into_waves(records):
+        runnable = []
+        for record in wave:
+            if record.session_id in failed_sessions:
+                # Running it would store this turn before the failed one on resume
+                yield _result(record, error=SKIPPED_ERROR)
+            else:
+                runnable.append(record)
+
+        for start in range(0, len(runnable), chunk_size):
+            chunk = runnable[start:start + chunk_size]
+            docs_per_record = [None] * len(chunk)
+            grouped = []
+            for i, record in enumerate(chunk):
+                if article_index is not None and ARTICLE_REFERENCE_PATTERN.search(record.human_input):
+                    # Exact article references skip the embedding and vector search. References
+                    # that need the session history to find their law are left to the chain.
+                    docs_per_record[i] = article_index.lookup(record.human_input) or None
+                    continue
+                grouped.append(i)
+
+            if grouped:
+                try:
+                    grouped_docs = await run_in_threadpool(
+                        retrieve_batch, retriever, [chunk[i].human_input for i in grouped]
+                    )
+                    for i, docs in zip(grouped, grouped_docs):
+                        docs_per_record[i] = docs
+                except Exception as e:
+                    # Fall back to per-turn retrieval inside the chain
+                    print(f"Warning: Grouped retrieval failed, retrieving per turn: {e}")
+
+            inputs = [
+                {"human_input": record.human_input, "docs": docs}
+                for record, docs in zip(chunk, docs_per_record)
+            ]
+            configs = [
+                {"configurable": {"session_id": record.session_id}, "max_concurrency": max_concurrency}
+                for record in chunk
+            ]
+            async for i, output in chain.abatch_as_completed(inputs, configs, return_exceptions=True):
+                record = chunk[i]
+                if isinstance(output, Exception):
+                    failed_sessions.add(record.session_id)
+                    yield _result(record, error=str(output))
+                else:
+                    yield _result(record, response=output["response"])
+
+
+def _result(record: BatchRecord, **outcome) -> dict:
+    """Build the result of a record, with either a `response` or an `error`."""
+    return {
+        "record_id": record.record_id,
+        "session_id": record.session_id,
+        "human_input": record.human_input,
+        **outcome,
+    }
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""Recall vs latency benchmark of two-stage Matryoshka retrieval on the BOE corpus.
+
+Ground truth is the exact top-k by cosine similarity over the full 3072-d vectors of
+the local Matryoshka index. Each configuration (coarse dimensions, int8 quantization,
+candidate count) is scored by recall@k against it and by mean query latency.
+
+Queries are real questions embedded with OpenAI (`--queries file.txt`, one per line).
+Without a query file, `--sample N` uses N chunk vectors of the corpus as queries; the
+sampled rows are held out of the searched corpus, otherwise each query's exact match
+would always be found and recall would be overstated.
+
+Usage:
+    python benchmark_retrieval.py --queries questions.txt --dims 64 128 256 512 --candidates 20 50 100 200
+"""
+import argparse
+import time
+
+import numpy as np
+
+from matryoshka_index import DEFAULT_INDEX_DIR, MatryoshkaIndex, build_coarse, coarse_search, rescore
+
+
+def exact_top_k(full: np.ndarray, query: np.ndarray, rows: np.ndarray, k: int) -> set:
+    """Return the exact top-k matches among the given rows of the full vectors."""
+    return {row for row, _ in rescore(full, query, rows, k)}
+
+
+def embed_queries(queries_path: str) -> np.ndarray:
+    """Embed the queries of a file, one per line."""
+    from dotenv import load_dotenv
+    from langchain_openai import OpenAIEmbeddings
+
+    load_dotenv()
+    with open(queries_path, encoding="utf-8") as f:
+        queries = [line.strip() for line in f if line.strip()]
+    embeddings = OpenAIEmbeddings(model="text-embedding-3-large", dimensions=3072)
+    return np.asarray(embeddings.embed_documents(queries), dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark two-stage Matryoshka retrieval.")
+    parser.add_argument("--index-dir", default=DEFAULT_INDEX_DIR, help="Directory of the Matryoshka index")
+    parser.add_argument("--queries", help="File with one query per line (embedded with OpenAI)")
+    parser.add_argument("--sample", type=int, help="Without --queries, number of corpus vectors held out as queries")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--k", type=int, default=5, help="Number of documents retrieved")
+    parser.add_argument("--dims", type=int, nargs="+", default=[64, 128, 256, 512, 1024])
+    parser.add_argument("--candidates", type=int, nargs="+", default=[20, 50, 100, 200])
+    args = parser.parse_args()
+    if not args.queries and not args.sample:
+        parser.error("pass --queries with real questions, or --sample to use held-out corpus vectors")
+
+    index = MatryoshkaIndex.load(args.index_dir)
+    if args.queries:
+        query_vectors = embed_queries(args.queries)
+        searched = np.arange(len(index.full))
+    else:
+        held_out = np.random.default_rng(args.seed).choice(
+            len(index.full), size=min(args.sample, len(index.full) - 1), replace=False
+        )
+        query_vectors = np.asarray(index.full[np.sort(held_out)], dtype=np.float32)
+        searched = np.setdiff1d(np.arange(len(index.full)), held_out)
+    print(f"{len(query_vectors)} queries over {len(searched)} vectors, k={args.k}")
+
+    started = time.perf_counter()
+    truth = [exact_top_k(index.full, query, searched, args.k) for query in query_vectors]
+    exact_ms = (time.perf_counter() - started) / len(query_vectors) * 1000
+    print(f"\nExact full-precision search: {exact_ms:.2f} ms/query, "
+          f"{index.full.shape[1] * 4} bytes/vector\n")
+
+    print(f"{'dims':>5} {'int8':>5} {'cand':>5} {'bytes/vec':>10} {'recall@k':>9} {'ms/query':>9}")
+    for dims in args.dims:
+        for quantize in (False, True):
+            coarse = build_coarse(index.full, dims, quantize)[searched]
+            for candidates in args.candidates:
+                hits = 0
+                started = time.perf_counter()
+                for query, expected in zip(query_vectors, truth):
+                    # Coarse rows are positions in `searched`, map them back to full rows
+                    rows = searched[coarse_search(coarse, query, max(candidates, args.k))]
+                    found = {row for row, _ in rescore(index.full, query, rows, args.k)}
+                    hits += len(found & expected)
+                elapsed_ms = (time.perf_counter() - started) / len(query_vectors) * 1000
+                recall = hits / (len(query_vectors) * args.k)
+                print(f"{dims:>5} {'yes' if quantize else 'no':>5} {candidates:>5} "
+                      f"{coarse.itemsize * dims:>10} {recall:>9.3f} {elapsed_ms:>9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Persistent WebSocket chat sessions.
+
+While a socket is open, the session's history, last retrieved context and turn counter
+are kept in memory, so each turn skips re-validating the session, re-reading the history
+file and re-establishing a connection. Tokens are streamed as they are generated and
+the history is written to durable storage in the background, in order. Sockets that
+stay silent for `CHAT_SOCKET_IDLE_SECONDS` are closed by the server.
+
+Protocol (JSON messages):
+    client -> {"human_input": "..."}            Ask a question
+    client -> {"type": "prefetch", "text": "..."}  Draft being typed (speculative retrieval)
+    server -> {"type": "ready", "turn": n}
+    server -> {"type": "sources", "citations": [...]}
+    server -> {"type": "token", "content": "..."}
+    server -> {"type": "end", "response": "...", "turn": n}
+    server -> {"type": "error", "detail": "..."}
+"""
+import asyncio
+import os
+import re
+
+from fastapi import WebSocket, WebSocketDisconnect
+from langchain_core.messages import AIMessage, HumanMessage
+
+from history_compaction import estimate_tokens
+
+# Citation headers that precede each chunk of the prompt context
+CONTEXT_HEADER_PATTERN = re.compile(r"(?m)^\[(.+)\]$")
+
+# Silence after which a socket is closed, so abandoned clients do not hold sessions open
+IDLE_TIMEOUT_SECONDS = float(os.getenv('CHAT_SOCKET_IDLE_SECONDS', '900'))
+
+
+class ChatSocketSession:
+    """In-memory state of a session while its WebSocket is open."""
+
+    def __init__(self, session_id: str, history):
+        self.session_id = session_id
+        self.history = history
+        self.messages = []
+        self.context = None
+        self.turns = 0
+        self._writes: "asyncio.Queue" = asyncio.Queue()
+        self._writer = None
+
+    async def load(self) -> None:
+        """Load the stored history once and start the background writer."""
+        self.messages = await asyncio.to_thread(lambda: self.history.messages)
+        state = await asyncio.to_thread(self.history.load_state)
+        self.turns = state["turns"]
+        self._writer = asyncio.create_task(self._write_history())
+
+    async def _write_history(self) -> None:
+        """Persist finished turns in order, off the streaming path."""
+        while True:
+            messages = await self._writes.get()
+            try:
+                await asyncio.to_thread(self.history.add_messages, messages)
+                compactor = self.history.compactor
+                if compactor is not None and self._writes.qsize() == 0 and \
+                        estimate_tokens(self.messages) > compactor.token_threshold:
+                    # Pick up the summary once the background compaction has run
+                    turns = self.turns
+                    stored = await asyncio.to_thread(lambda: self.history.messages)
+                    if turns == self.turns:
+                        self.messages = stored
+            except Exception as e:
+                print(f"Warning: Could not store history for session {self.session_id}: {e}")
+            finally:
+                self._writes.task_done()
+
+    def record_turn(self, human_input: str, response: str) -> None:
+        """Add a finished turn to the in-memory state and queue it for storage."""
+        turn = [HumanMessage(content=human_input), AIMessage(content=response)]
+        self.messages = self.messages + turn
+        self.turns += 1
+        self._writes.put_nowait(turn)
+
+    async def close(self) -> None:
+        """Wait for pending history writes and stop the writer."""
+        if self._writer is None:
+            return
+        await self._writes.join()
+        self._writer.cancel()
+
+
+async def serve_chat_socket(
+    websocket: WebSocket,
+    session: ChatSocketSession,
+    context_retriever,
+    generation_chain,
+    prefetch_cache=None,
+) -> None:
+    """
+    Answer the questions sent over an accepted WebSocket until the client disconnects
+
+    Args:
+        websocket: The accepted WebSocket
+        session: The in-memory state of the session
+        context_retriever: Runnable mapping the inputs to the prompt context
+        generation_chain: Chain mapping context, history and input to the model message
+        prefetch_cache: Optional PrefetchCache for drafts sent over the socket
+    """
+    await session.load()
+    await websocket.send_json({"type": "ready", "turn": session.turns})
+    config = {"configurable": {"session_id": session.session_id}}
+
+    try:
+        while True:
+            try:
+                data = await asyncio.wait_for(websocket.receive_json(), IDLE_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                await websocket.close(code=1000, reason="Idle timeout")
+                break
+            except (ValueError, KeyError):
+                # Not JSON, or a binary frame
+                await websocket.send_json({"type": "error", "detail": "Messages must be JSON objects"})
+                continue
+            if not isinstance(data, dict):
+                await websocket.send_json({"type": "error", "detail": "Messages must be JSON objects"})
+                continue
+
+            if data.get("type") == "prefetch":
+                if prefetch_cache is not None and isinstance(data.get("text", ""), str):
+                    prefetch_cache.prefetch(session.session_id, data.get("text", ""))
+                continue
+
+            human_input = data.get("human_input")
+            human_input = human_input.strip() if isinstance(human_input, str) else ""
+            if not human_input:
+                await websocket.send_json({"type": "error", "detail": "Empty human_input"})
+                continue
+
+            inputs = {"human_input": human_input, "history": session.messages}
+            try:
+                session.context = await context_retriever.ainvoke(inputs, config)
+            except Exception as e:
+                # Never answer from another question's articles
+                await websocket.send_json({"type": "error", "detail": f"Retrieval failed: {e}"})
+                continue
+            await websocket.send_json({
+                "type": "sources",
+                "citations": CONTEXT_HEADER_PATTERN.findall(session.context),
+            })
+
+            response = ""
+            try:
+                async for chunk in generation_chain.astream({**inputs, "context": session.context}, config):
+                    if isinstance(chunk.content, str) and chunk.content:
+                        response += chunk.content
+                        await websocket.send_json({"type": "token", "content": chunk.content})
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                await websocket.send_json({"type": "error", "detail": f"Generation failed: {e}"})
+                continue
+
+            session.record_turn(human_input, response)
+            await websocket.send_json({"type": "end", "response": response, "turn": session.turns})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await session.close()
@@ -0,0 +1,214 @@
+"""Background compaction of long LegifAI chat histories.
+
+Once a session grows past a token threshold, its older turns are summarized by a
+background worker and removed from the history file. The running summary and the
+turn counter are stored next to the session, so prompts are built from the summary
+plus the most recent turns and stay bounded however long the conversation runs.
+"""
+import json
+import os
+import queue
+import threading
+import zlib
+from typing import Callable, List, Optional, Sequence
+
+from langchain_community.chat_message_histories import FileChatMessageHistory
+from langchain_core.messages import (
+    BaseMessage,
+    HumanMessage,
+    SystemMessage,
+    get_buffer_string,
+    messages_to_dict,
+)
+
+# Compaction settings, overridable from the environment
+DEFAULT_TOKEN_THRESHOLD = int(os.getenv('HISTORY_COMPACTION_TOKENS', '3000'))
+DEFAULT_KEEP_MESSAGES = int(os.getenv('HISTORY_KEEP_MESSAGES', '4'))
+
+# Sessions share a fixed set of striped locks, so memory stays bounded however many
+# sessions are touched. They are reentrant so a history can restore its archived
+# session while holding its lock.
+SESSION_LOCK_STRIPES = 1024
+_session_locks = [threading.RLock() for _ in range(SESSION_LOCK_STRIPES)]
+
+
+def get_session_lock(session_id: str) -> threading.RLock:
+    """Return the lock guarding the stored history of a session."""
+    return _session_locks[zlib.crc32(session_id.encode("utf-8")) % SESSION_LOCK_STRIPES]
+
+
+def estimate_tokens(messages: Sequence[BaseMessage]) -> int:
+    """Roughly estimate the number of tokens in a list of messages (~4 chars per token)."""
+    return sum(len(str(message.content)) for message in messages) // 4
+
+
+class CompactingChatMessageHistory(FileChatMessageHistory):
+    """File chat history that keeps a running summary of its compacted turns.
+
+    The recent messages are stored in the usual `FileChatMessageHistory` format, while
+    the summary and the turn counter live in a `<session_id>.state.json` file next to it.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        session_id: str,
+        compactor: "HistoryCompactor" = None,
+        restore: Optional[Callable[[str], bool]] = None,
+    ):
+        """
+        Args:
+            file_path: Path of the history file
+            session_id: ID of the session
+            compactor: Optional background compactor that summarizes long histories
+            restore: Optional function bringing the session back from the archive
+        """
+        super().__init__(file_path)
+        self.session_id = session_id
+        self.compactor = compactor
+        self.restore = restore
+        self.state_path = self.file_path.with_suffix(".state.json")
+
+    def _ensure_live(self) -> None:
+        """Restore the session if it was archived while this history object was in use."""
+        if self.restore is not None and not self.file_path.exists():
+            self.restore(self.session_id)
+
+    def load_state(self) -> dict:
+        """Load the stored summary and turn counter of the session."""
+        if not self.state_path.exists():
+            return {"summary": "", "turns": 0, "compacted_messages": 0}
+        return json.loads(self.state_path.read_text(encoding=self.encoding))
+
+    def save_state(self, state: dict) -> None:
+        """Atomically store the summary and turn counter of the session."""
+        tmp_path = self.state_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(state, ensure_ascii=self.ensure_ascii), encoding=self.encoding)
+        tmp_path.replace(self.state_path)
+
+    @property
+    def recent_messages(self) -> List[BaseMessage]:
+        """Messages that have not been compacted into the summary yet."""
+        if not self.file_path.exists():
+            # Archived session, with no restore function to bring it back
+            return []
+        return super().messages
+
+    @property
+    def messages(self) -> List[BaseMessage]:  # type: ignore[override]
+        """Summary of the compacted turns followed by the recent messages."""
+        self._ensure_live()
+        messages = self.recent_messages
+        state = self.load_state()
+        if state["summary"]:
+            summary = SystemMessage(
+                content=f"Esta consulta lleva {state['turns']} interacciones. "
+                f"Resumen de las interacciones anteriores: {state['summary']}"
+            )
+            return [summary] + messages
+        return messages
+
+    def add_message(self, message: BaseMessage) -> None:
+        """Append a message to the history file."""
+        self.add_messages([message])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Append messages, update the turn counter and schedule compaction if needed."""
+        with get_session_lock(self.session_id):
+            # Never start a fresh file over the turns of an archived session
+            self._ensure_live()
+            stored = self.recent_messages + list(messages)
+            self.write_messages(stored)
+            turns = sum(isinstance(message, HumanMessage) for message in messages)
+            if turns:
+                state = self.load_state()
+                state["turns"] += turns
+                self.save_state(state)
+
+        if self.compactor is not None and estimate_tokens(stored) > self.compactor.token_threshold:
+            self.compactor.schedule(self)
+
+    def write_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Overwrite the history file with the given messages."""
+        self.file_path.write_text(
+            json.dumps(messages_to_dict(messages), ensure_ascii=self.ensure_ascii),
+            encoding=self.encoding,
+        )
+
+    def clear(self) -> None:
+        """Clear the messages, the summary and the turn counter."""
+        with get_session_lock(self.session_id):
+            super().clear()
+            if self.state_path.exists():
+                self.state_path.unlink()
+
+
+class HistoryCompactor:
+    """Summarizes the older turns of long sessions off the request path."""
+
+    def __init__(
+        self,
+        summarizer,
+        token_threshold: int = DEFAULT_TOKEN_THRESHOLD,
+        keep_messages: int = DEFAULT_KEEP_MESSAGES,
+    ):
+        """
+        Args:
+            summarizer: Runnable mapping `{"summary", "conversation"}` to the new summary text
+            token_threshold: Estimated history size (in tokens) that triggers compaction
+            keep_messages: Number of most recent messages kept verbatim
+        """
+        self.summarizer = summarizer
+        self.token_threshold = token_threshold
+        self.keep_messages = keep_messages
+        self._queue: "queue.Queue[CompactingChatMessageHistory]" = queue.Queue()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="history-compactor", daemon=True)
+        self._worker.start()
+
+    def schedule(self, history: CompactingChatMessageHistory) -> None:
+        """Queue a session for compaction unless it is already queued."""
+        with self._pending_lock:
+            if history.session_id in self._pending:
+                return
+            self._pending.add(history.session_id)
+        self._queue.put(history)
+
+    def _run(self) -> None:
+        while True:
+            history = self._queue.get()
+            try:
+                self.compact(history)
+            except Exception as e:
+                print(f"Warning: Could not compact history for session {history.session_id}: {e}")
+            finally:
+                with self._pending_lock:
+                    self._pending.discard(history.session_id)
+
+    def compact(self, history: CompactingChatMessageHistory) -> None:
+        """Fold the older turns of a session into its summary."""
+        with get_session_lock(history.session_id):
+            messages = history.recent_messages
+            if estimate_tokens(messages) <= self.token_threshold or len(messages) <= self.keep_messages:
+                return
+            old_messages = messages[:-self.keep_messages] if self.keep_messages else messages
+            previous_summary = history.load_state()["summary"]
+
+        # The LLM call runs without holding the lock, so new turns can be stored meanwhile
+        summary = self.summarizer.invoke({
+            "summary": previous_summary or "(sin resumen previo)",
+            "conversation": get_buffer_string(old_messages, human_prefix="Usuario", ai_prefix="LegifAI"),
+        })
+
+        with get_session_lock(history.session_id):
+            messages = history.recent_messages
+            # Only compaction removes messages, so the summarized ones are still at the front
+            if messages[:len(old_messages)] != old_messages:
+                return
+            history.write_messages(messages[len(old_messages):])
+            state = history.load_state()
+            state["summary"] = summary
+            state["compacted_messages"] += len(old_messages)
+            history.save_state(state)
+        print(f"Compacted {len(old_messages)} messages of session {history.session_id}")
@@ -3,10 +3,24 @@
 
 import gradio as gr
 import requests
+import asyncio
+import threading
 import uuid
 import json
 import os
-from typing import List, Tuple
+import time
+from typing import Dict, Iterator, List, Tuple
+from websockets.sync.client import connect as websocket_connect
+
+# Longest wait for the next message of a streamed response
+SOCKET_RECEIVE_TIMEOUT_SECONDS = 60
+
+# Sockets unused for this long are closed, e.g. when the browser tab was closed
+SOCKET_IDLE_SECONDS = float(os.getenv('CHAT_SOCKET_CLIENT_IDLE_SECONDS', '300'))
+
+# Typing pause after which a draft message is prefetched
+PREFETCH_DEBOUNCE_SECONDS = float(os.getenv('PREFETCH_DEBOUNCE_SECONDS', '0.6'))
+PREFETCH_MIN_CHARS = int(os.getenv('PREFETCH_MIN_CHARS', '20'))
 
 class LegifAIGradioClient:
     def __init__(self, api_base_url: str = None):
@@ -26,6 +40,19 @@ class LegifAIGradioClient:
         else:
             self.api_base_url = api_base_url
             print(f"LegifAI Gradio Client: Using provided URL: {self.api_base_url}")
+
+        # Latest draft of each session, used to debounce prefetch requests
+        self._drafts: Dict[str, str] = {}
+
+        # Open WebSocket connection of each session
+        self._sockets: Dict[str, "_SessionSocket"] = {}
+        self._sockets_lock = threading.Lock()
+
+        # Consultation session of each open page, to close its socket when the page unloads
+        self._page_sessions: Dict[str, str] = {}
+
+        self._idle_sweeper = threading.Thread(target=self._close_idle_sockets, name="socket-sweeper", daemon=True)
+        self._idle_sweeper.start()
         
     def send_message_to_api(self, message: str, session_id: str) -> str:
         """Send a message to the FastAPI backend."""
@@ -62,29 +89,192 @@ class LegifAIGradioClient:
         except Exception as e:
             return f"❌ Error inesperado: {str(e)}"
 
-    def chat_response(self, message: str, history: List[Tuple[str, str]], session_id: str) -> Tuple[str, List[Tuple[str, str]], str]:
-        """Process chat message and return response."""
+    def _get_socket(self, session_id: str) -> "_SessionSocket":
+        """Return the open WebSocket of a session, connecting if needed."""
+        with self._sockets_lock:
+            entry = self._sockets.get(session_id)
+        if entry is not None:
+            return entry
+
+        ws_base_url = self.api_base_url.replace("http", "ws", 1)
+        socket = websocket_connect(f"{ws_base_url}/chat/ws?session_id={session_id}", open_timeout=10, legacy=True)
+        ready = json.loads(socket.recv(timeout=SOCKET_RECEIVE_TIMEOUT_SECONDS))
+        if ready.get("type") != "ready":
+            socket.close()
+            raise ConnectionError(f"Unexpected WebSocket greeting: {ready}")
+        with self._sockets_lock:
+            entry = self._sockets.setdefault(session_id, _SessionSocket(socket))
+        if entry.socket is not socket:
+            # Another handler of the same session connected first
+            socket.close()
+        return entry
+
+    def _close_socket(self, session_id: str) -> None:
+        """Close the WebSocket of a session, if any."""
+        with self._sockets_lock:
+            entry = self._sockets.pop(session_id, None)
+        if entry is not None:
+            entry.close()
+
+    def _discard_socket(self, session_id: str, entry: "_SessionSocket") -> None:
+        """Close a socket and forget it, unless the session already has a newer one."""
+        with self._sockets_lock:
+            if self._sockets.get(session_id) is entry:
+                del self._sockets[session_id]
+        entry.close()
+
+    def _close_idle_sockets(self) -> None:
+        """Periodically close the sockets of sessions that stopped chatting."""
+        while True:
+            time.sleep(min(SOCKET_IDLE_SECONDS, 60))
+            cutoff = time.monotonic() - SOCKET_IDLE_SECONDS
+            with self._sockets_lock:
+                idle = [(session_id, entry) for session_id, entry in self._sockets.items() if entry.last_used < cutoff]
+            for session_id, entry in idle:
+                # Sockets in the middle of a turn are left alone
+                if entry.lock.acquire(blocking=False):
+                    try:
+                        self._discard_socket(session_id, entry)
+                    finally:
+                        entry.lock.release()
+
+    def close_page(self, page_id: str) -> None:
+        """Release the resources of a page that was closed or reloaded."""
+        session_id = self._page_sessions.pop(page_id, None)
+        if session_id:
+            self._drafts.pop(session_id, None)
+            self._close_socket(session_id)
+
+    def stream_message_over_socket(self, message: str, session_id: str) -> Iterator[str]:
+        """Send a message over the session's WebSocket and yield the response as it grows."""
+        while True:
+            entry = self._get_socket(session_id)
+            # One turn at a time per socket, so concurrent submits never interleave their messages
+            if not entry.lock.acquire(timeout=SOCKET_RECEIVE_TIMEOUT_SECONDS):
+                raise TimeoutError(f"WebSocket of session {session_id} is busy")
+            if not entry.closed:
+                break
+            # The socket was closed while this turn waited for it
+            entry.lock.release()
+        finished = False
+        try:
+            entry.socket.send(json.dumps({"human_input": message}))
+            response = ""
+            while True:
+                event = json.loads(entry.socket.recv(timeout=SOCKET_RECEIVE_TIMEOUT_SECONDS))
+                if event["type"] == "token":
+                    response += event["content"]
+                    yield response
+                elif event["type"] == "end":
+                    finished = True
+                    yield event["response"]
+                    return
+                elif event["type"] == "error":
+                    finished = True
+                    yield f"❌ Error: {event['detail']}"
+                    return
+        finally:
+            entry.last_used = time.monotonic()
+            if not finished:
+                # Unread messages of an abandoned or failed turn would leak into the next one
+                self._discard_socket(session_id, entry)
+            entry.lock.release()
+
+    def send_prefetch_to_api(self, text: str, session_id: str) -> None:
+        """Ask the backend to speculatively retrieve context for a draft message."""
+        try:
+            requests.post(
+                f"{self.api_base_url}/chat/prefetch",
+                json={"session_id": session_id, "text": text},
+                timeout=5,
+            )
+        except requests.exceptions.RequestException:
+            # Prefetching is best effort, the message is still answered on submit
+            pass
+
+    async def prefetch_draft(self, message: str, session_id: str) -> None:
+        """Prefetch context for the draft message once the user pauses typing."""
+        if not session_id:
+            return
+        message = message.strip()
+        previous = self._drafts.get(session_id)
+        self._drafts[session_id] = message
+
+        await asyncio.sleep(PREFETCH_DEBOUNCE_SECONDS)
+        if self._drafts.get(session_id) != message:
+            # The user kept typing, a newer event will handle it
+            return
+
+        if len(message) >= PREFETCH_MIN_CHARS:
+            await asyncio.to_thread(self.send_prefetch_to_api, message, session_id)
+        elif previous and len(previous) >= PREFETCH_MIN_CHARS:
+            # The draft was cleared or shortened: cancel the speculative work
+            await asyncio.to_thread(self.send_prefetch_to_api, "", session_id)
+        if not message:
+            self._drafts.pop(session_id, None)
+
+    def chat_response(self, message: str, history: List[Tuple[str, str]], session_id: str) -> Iterator[Tuple[str, List[Tuple[str, str]], str]]:
+        """Process chat message and stream the response."""
         if not message.strip():
-            return "", history, session_id
+            yield "", history, session_id
+            return
             
         # Generate session ID if not provided
         if not session_id:
             session_id = f"gradio-session-{uuid.uuid4()}"
+
+        # The message is submitted, pending prefetches of its draft are no longer needed
+        self._drafts.pop(session_id, None)
             
+        history = history or []
+        history.append((message, ""))
+
+        # Stream the response over the session's WebSocket
+        streamed = False
+        try:
+            for partial_response in self.stream_message_over_socket(message, session_id):
+                streamed = True
+                history[-1] = (message, partial_response)
+                yield "", history, session_id
+            return
+        except Exception as e:
+            if streamed:
+                history[-1] = (message, history[-1][1] + "\n\n❌ Se perdió la conexión con el servidor.")
+                yield "", history, session_id
+                return
+            print(f"WebSocket unavailable for session {session_id}, using HTTP: {e}")
+
         # Get response from API
         bot_response = self.send_message_to_api(message, session_id)
-        
-        # Update history
-        history = history or []
-        history.append((message, bot_response))
-        
-        return "", history, session_id
+        history[-1] = (message, bot_response)
+        yield "", history, session_id
+
+    def close_session(self, session_id: str) -> None:
+        """Ask the backend to archive a finished consultation."""
+        try:
+            # The web interface runs next to the API and shares its admin key
+            admin_key = os.getenv('ADMIN_API_KEY')
+            requests.post(
+                f"{self.api_base_url}/sessions/{session_id}/close",
+                headers={"X-Admin-Key": admin_key} if admin_key else {},
+                timeout=5,
+            )
+        except requests.exceptions.RequestException as e:
+            print(f"Warning: Could not close session {session_id}: {e}")
 
-    def clear_conversation(self) -> Tuple[List, str]:
-        """Clear the conversation and generate a new session ID."""
+    def clear_conversation(self, session_id: str = None) -> Tuple[List, str]:
+        """Close the current consultation and generate a new session ID."""
+        if session_id:
+            self._close_socket(session_id)
+            self.close_session(session_id)
         new_session_id = f"gradio-session-{uuid.uuid4()}"
         return [], new_session_id
 
+    def track_page(self, page_id: str, session_id: str) -> None:
+        """Remember the consultation session currently shown by a page."""
+        if page_id and session_id:
+            self._page_sessions[page_id] = session_id
+
     def create_interface(self) -> gr.Blocks:
         """Create the Gradio interface."""
         
@@ -156,8 +346,8 @@ class LegifAIGradioClient:
                     with gr.Row():
                         clear_btn = gr.Button("Nueva Consulta", variant="secondary")
                         
-                    # Session ID (hidden)
-                    session_id = gr.State(f"gradio-session-{uuid.uuid4()}")
+                    # Session ID (hidden), assigned per page when it loads
+                    session_id = gr.State()
                     
                     # Session info
                     gr.Markdown(
@@ -190,11 +380,26 @@ class LegifAIGradioClient:
             """)
             
             # Event handlers
-            def respond(message, history, session_id):
-                return self.chat_response(message, history, session_id)
+            def start_session(request: gr.Request):
+                new_session_id = f"gradio-session-{uuid.uuid4()}"
+                self.track_page(request.session_hash, new_session_id)
+                return new_session_id
+
+            def respond(message, history, session_id, request: gr.Request):
+                for output in self.chat_response(message, history, session_id):
+                    self.track_page(request.session_hash, output[2])
+                    yield output
             
-            def clear():
-                return self.clear_conversation()
+            def clear(session_id, request: gr.Request):
+                history, new_session_id = self.clear_conversation(session_id)
+                self.track_page(request.session_hash, new_session_id)
+                return history, new_session_id
+
+            def unload(request: gr.Request):
+                self.close_page(request.session_hash)
+
+            async def prefetch(message, session_id):
+                await self.prefetch_draft(message, session_id)
             
             # Set up interactions
             send_btn.click(
@@ -209,13 +414,46 @@ class LegifAIGradioClient:
                 outputs=[msg, chatbot, session_id]
             )
             
+            # Speculatively retrieve context while the user types. Every keystroke runs
+            # its own handler so the debounce sees the latest draft
+            msg.change(
+                prefetch,
+                inputs=[msg, session_id],
+                outputs=None,
+                trigger_mode="multiple",
+                concurrency_limit=None,
+                show_progress="hidden",
+            )
+            
             clear_btn.click(
                 clear,
+                inputs=[session_id],
                 outputs=[chatbot, session_id]
             )
+
+            # Every page gets its own consultation, and its socket is closed with the page
+            interface.load(start_session, inputs=None, outputs=[session_id])
+            interface.unload(unload)
         
         return interface
 
+class _SessionSocket:
+    """Open WebSocket of a session, used by one turn at a time."""
+
+    def __init__(self, socket):
+        self.socket = socket
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.closed = False
+
+    def close(self) -> None:
+        self.closed = True
+        try:
+            self.socket.close()
+        except Exception:
+            pass
+
+
 def create_gradio_app(api_base_url: str = None) -> gr.Blocks:
     """Create and return the Gradio application."""
     client = LegifAIGradioClient(api_base_url)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""Two-stage retrieval over Matryoshka-truncated embeddings.
+
+`text-embedding-3-large` vectors can be truncated to a prefix and renormalized with
+little loss in quality. The coarse stage searches every chunk using only the first
+`dims` components (optionally int8-quantized), which is 12x smaller than the full
+3072-d vector at 256 dims (48x with int8). The few best candidates are then rescored
+with their full-precision vectors, read from a memory-mapped file so only the
+candidate rows are loaded.
+
+Build the local index from the Pinecone index with:
+    python matryoshka_index.py build --dims 256 --int8
+"""
+import argparse
+import json
+import os
+from pathlib import Path
+from typing import Any, List
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+DEFAULT_INDEX_DIR = os.getenv('MATRYOSHKA_INDEX_DIR', 'matryoshka_index')
+DEFAULT_DIMS = int(os.getenv('MATRYOSHKA_DIMS', '256'))
+DEFAULT_CANDIDATES = int(os.getenv('MATRYOSHKA_CANDIDATES', '100'))
+FULL_DIMS = 3072
+
+# Rows scored at once in the coarse stage, to bound temporary memory
+BLOCK_ROWS = 65536
+
+# Rows of int8 vectors dequantized at once, small enough for the buffer to stay in cache
+INT8_BLOCK_ROWS = 1024
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize vectors along the last axis."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def build_coarse(full: np.ndarray, dims: int, quantize: bool) -> np.ndarray:
+    """
+    Truncate full vectors to their first `dims` components and renormalize them
+
+    Args:
+        full: Full-precision vectors, shape (n, 3072)
+        dims: Number of leading components to keep
+        quantize: Whether to store the coarse vectors as int8
+
+    Returns:
+        np.ndarray: Coarse vectors, shape (n, dims)
+    """
+    blocks = []
+    for start in range(0, len(full), BLOCK_ROWS):
+        block = normalize(np.asarray(full[start:start + BLOCK_ROWS, :dims], dtype=np.float32))
+        if quantize:
+            # Components of a unit vector lie in [-1, 1], so a fixed scale keeps ranking intact
+            block = np.clip(np.rint(block * 127), -127, 127).astype(np.int8)
+        blocks.append(block)
+    if not blocks:
+        return np.zeros((0, dims), dtype=np.int8 if quantize else np.float32)
+    return np.concatenate(blocks)
+
+
+def coarse_search(coarse: np.ndarray, query: np.ndarray, candidates: int) -> np.ndarray:
+    """Return the row numbers of the `candidates` best coarse matches, unordered."""
+    dims = coarse.shape[1]
+    query = normalize(np.asarray(query[:dims], dtype=np.float32))
+    scores = np.empty(len(coarse), dtype=np.float32)
+    if coarse.dtype == np.int8:
+        # Dequantize through a small reused buffer instead of a float copy of the matrix,
+        # so the int8 stage reads 4x less memory than the float one
+        buffer = np.empty((INT8_BLOCK_ROWS, dims), dtype=np.float32)
+        for start in range(0, len(coarse), INT8_BLOCK_ROWS):
+            block = coarse[start:start + INT8_BLOCK_ROWS]
+            np.copyto(buffer[:len(block)], block)
+            np.matmul(buffer[:len(block)], query, out=scores[start:start + len(block)])
+    else:
+        for start in range(0, len(coarse), BLOCK_ROWS):
+            block = coarse[start:start + BLOCK_ROWS]
+            scores[start:start + len(block)] = block @ query
+    candidates = min(candidates, len(scores))
+    if candidates == len(scores):
+        return np.arange(len(scores))
+    return np.argpartition(-scores, candidates - 1)[:candidates]
+
+
+def rescore(full: np.ndarray, query: np.ndarray, rows: np.ndarray, k: int) -> List[tuple]:
+    """Rank candidate rows by cosine similarity with their full vectors.
+
+    Returns:
+        list: `(row, score)` pairs of the best `k` candidates, best first
+    """
+    rows = np.sort(rows)  # Sequential reads from the memory-mapped file
+    query = normalize(np.asarray(query, dtype=np.float32))
+    scores = np.asarray(full[rows], dtype=np.float32) @ query
+    order = np.argsort(-scores)[:k]
+    return [(int(rows[i]), float(scores[i])) for i in order]
+
+
+class MatryoshkaIndex:
+    """Coarse truncated vectors in memory, full vectors and documents on disk."""
+
+    def __init__(self, index_dir: str, coarse: np.ndarray, full: np.ndarray, documents: List[dict]):
+        self.index_dir = index_dir
+        self.coarse = coarse
+        self.full = full
+        self.documents = documents
+
+    @classmethod
+    def load(cls, index_dir: str = DEFAULT_INDEX_DIR) -> "MatryoshkaIndex":
+        """Load an index built with `python matryoshka_index.py build`."""
+        path = Path(index_dir)
+        if not (path / "meta.json").exists():
+            raise ValueError(f"Matryoshka index not found in {index_dir}; build it with "
+                             "`python matryoshka_index.py build`")
+        meta = json.loads((path / "meta.json").read_text())
+        full = np.memmap(path / "full.f32", dtype=np.float32, mode="r", shape=(meta["count"], meta["full_dims"]))
+        coarse = np.load(path / "coarse.npy")
+        with open(path / "documents.jsonl", encoding="utf-8") as f:
+            documents = [json.loads(line) for line in f]
+        print(f"Loaded Matryoshka index: {meta['count']} vectors, {coarse.shape[1]} coarse dims "
+              f"({coarse.dtype}, {coarse.nbytes / 1e6:.1f} MB in memory)")
+        return cls(index_dir, coarse, full, documents)
+
+    def search(self, query: List[float], k: int = 5, candidates: int = DEFAULT_CANDIDATES) -> List[tuple]:
+        """Return `(Document, score)` pairs for the best `k` chunks."""
+        rows = coarse_search(self.coarse, np.asarray(query), max(candidates, k))
+        results = []
+        for row, score in rescore(self.full, np.asarray(query), rows, k):
+            document = self.documents[row]
+            results.append((
+                Document(id=document["id"], page_content=document["text"], metadata=document["metadata"]),
+                score,
+            ))
+        return results
+
+
+class TwoStageRetriever(BaseRetriever):
+    """Retriever doing a coarse truncated-vector search followed by full-precision rescoring."""
+
+    index: Any
+    embeddings: Any
+    k: int = 5
+    candidates: int = DEFAULT_CANDIDATES
+
+    def search_by_vector(self, vector: List[float]) -> List[Document]:
+        """Retrieve documents for an already embedded query."""
+        return [doc for doc, _ in self.index.search(vector, k=self.k, candidates=self.candidates)]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.search_by_vector(self.embeddings.embed_query(query))
+
+
+def build_from_pinecone(index_dir: str, dims: int, quantize: bool, text_key: str = "text", batch_size: int = 100):
+    """Export every vector of the BOE Pinecone index into a local Matryoshka index."""
+    from article_index import iter_pinecone_chunks
+
+    path = Path(index_dir)
+    path.mkdir(parents=True, exist_ok=True)
+
+    # Stream the full vectors to disk, they do not need to fit in memory
+    count = 0
+    with open(path / "full.f32", "wb") as full_file, \
+            open(path / "documents.jsonl", "w", encoding="utf-8") as documents_file:
+        for chunk_id, text, metadata, values in iter_pinecone_chunks(text_key, batch_size, include_values=True):
+            full_file.write(normalize(np.asarray(values, dtype=np.float32)).tobytes())
+            documents_file.write(json.dumps({"id": chunk_id, "text": text, "metadata": metadata},
+                                            ensure_ascii=False) + "\n")
+            count += 1
+            if count % batch_size == 0:
+                print(f"Exported {count} vectors")
+
+    if count == 0:
+        raise ValueError(f"No vectors with a `{text_key}` metadata field were exported from the Pinecone index; "
+                         "check that the index is populated and the text key is correct")
+
+    full = np.memmap(path / "full.f32", dtype=np.float32, mode="r", shape=(count, FULL_DIMS))
+    np.save(path / "coarse.npy", build_coarse(full, dims, quantize))
+    (path / "meta.json").write_text(json.dumps({
+        "count": count,
+        "full_dims": FULL_DIMS,
+        "dims": dims,
+        "quantized": quantize,
+    }))
+    print(f"Built Matryoshka index in {index_dir}: {count} vectors, {dims} coarse dims"
+          f"{' (int8)' if quantize else ''}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the local Matryoshka index.")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--index-dir", default=DEFAULT_INDEX_DIR, help="Directory of the index")
+    parser.add_argument("--dims", type=int, default=DEFAULT_DIMS, help="Dimensions of the coarse vectors")
+    parser.add_argument("--int8", action="store_true", help="Quantize the coarse vectors to int8")
+    args = parser.parse_args()
+    build_from_pinecone(args.index_dir, args.dims, args.int8)
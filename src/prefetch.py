@@ -0,0 +1,191 @@
+"""Speculative retrieval for messages that are still being typed.
+
+The web interface sends the draft message after a typing pause. Retrieval for the
+draft runs in the background and its documents are cached under the session. When the
+message is finally submitted, the chain reuses them if the submitted text is identical
+or close enough to the draft, so the embedding and vector search latency is hidden
+behind the user's typing.
+"""
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor, TimeoutError
+from difflib import SequenceMatcher
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.documents import Document
+
+# Prefetch settings, overridable from the environment
+DEFAULT_MIN_CHARS = int(os.getenv('PREFETCH_MIN_CHARS', '20'))
+DEFAULT_MIN_INTERVAL_SECONDS = float(os.getenv('PREFETCH_MIN_INTERVAL_SECONDS', '1.0'))
+DEFAULT_TTL_SECONDS = float(os.getenv('PREFETCH_TTL_SECONDS', '120'))
+DEFAULT_SIMILARITY = float(os.getenv('PREFETCH_SIMILARITY', '0.9'))
+
+# Longest time a submitted message waits for a prefetch of the same text still in flight
+IN_FLIGHT_WAIT_SECONDS = 5.0
+
+
+class _Prefetch:
+    """A speculative retrieval for the draft of one session."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.requested_at = time.monotonic()
+        self.future = None
+
+
+class _TrailingPrefetch:
+    """The latest draft of a session, waiting for the rate limit interval to pass."""
+
+    def __init__(self, text: str, timer: threading.Timer):
+        self.text = text
+        self.timer = timer
+
+
+class PrefetchCache:
+    """Per-session cache of speculative retrieval results."""
+
+    def __init__(
+        self,
+        retrieve: Callable[[str], List[Document]],
+        min_chars: int = DEFAULT_MIN_CHARS,
+        min_interval_seconds: float = DEFAULT_MIN_INTERVAL_SECONDS,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        similarity: float = DEFAULT_SIMILARITY,
+        max_workers: int = 4,
+    ):
+        """
+        Args:
+            retrieve: Function returning the documents for a query
+            min_chars: Drafts shorter than this are not prefetched
+            min_interval_seconds: Minimum time between two prefetches of the same session
+            ttl_seconds: Time after which an unused prefetch is discarded
+            similarity: Minimum similarity ratio between draft and submitted text to reuse a prefetch
+            max_workers: Number of prefetches running at the same time across sessions
+        """
+        self.retrieve = retrieve
+        self.min_chars = min_chars
+        self.min_interval_seconds = min_interval_seconds
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self._entries: Dict[str, _Prefetch] = {}
+        self._trailing: Dict[str, _TrailingPrefetch] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+
+    def prefetch(self, session_id: str, text: str) -> str:
+        """
+        Start a speculative retrieval for the draft of a session
+
+        A newer draft replaces the previous prefetch of the session, cancelling it if it
+        has not started yet. Within `min_interval_seconds` of the previous prefetch, the
+        draft is deferred: only the latest deferred draft runs, once the interval has
+        passed. Drafts shorter than `min_chars` cancel the session's prefetch.
+
+        Returns:
+            str: "scheduled", "deferred", "cached" or "cancelled"
+        """
+        text = text.strip()
+        if len(text) < self.min_chars:
+            self.cancel(session_id)
+            return "cancelled"
+
+        with self._lock:
+            self._purge_expired()
+            previous = self._entries.get(session_id)
+            if previous is not None and previous.text == text:
+                self._cancel_trailing(session_id)
+                return "cached"
+            wait = self.min_interval_seconds - (time.monotonic() - previous.requested_at) if previous else 0
+            if wait > 0:
+                trailing = self._trailing.get(session_id)
+                if trailing is not None:
+                    trailing.text = text
+                else:
+                    timer = threading.Timer(wait, self._run_trailing, args=(session_id,))
+                    timer.daemon = True
+                    self._trailing[session_id] = _TrailingPrefetch(text, timer)
+                    timer.start()
+                return "deferred"
+            self._cancel_trailing(session_id)
+            self._start(session_id, text)
+        return "scheduled"
+
+    def _start(self, session_id: str, text: str) -> None:
+        """Replace the prefetch of a session. Must be called with the lock held."""
+        previous = self._entries.get(session_id)
+        if previous is not None:
+            previous.future.cancel()
+        entry = self._entries[session_id] = _Prefetch(text)
+        entry.future = self._executor.submit(self._run, text)
+
+    def _run_trailing(self, session_id: str) -> None:
+        """Start the deferred draft of a session once the rate limit interval has passed."""
+        with self._lock:
+            trailing = self._trailing.pop(session_id, None)
+            if trailing is None:
+                return
+            previous = self._entries.get(session_id)
+            if previous is None or previous.text != trailing.text:
+                self._start(session_id, trailing.text)
+
+    def _cancel_trailing(self, session_id: str) -> None:
+        """Drop the deferred draft of a session. Must be called with the lock held."""
+        trailing = self._trailing.pop(session_id, None)
+        if trailing is not None:
+            trailing.timer.cancel()
+
+    def _run(self, text: str) -> Optional[List[Document]]:
+        try:
+            return self.retrieve(text)
+        except Exception as e:
+            print(f"Warning: Prefetch failed: {e}")
+            return None
+
+    def _purge_expired(self) -> None:
+        """Drop prefetches nobody used in time. Must be called with the lock held."""
+        cutoff = time.monotonic() - self.ttl_seconds
+        for session_id in [key for key, entry in self._entries.items() if entry.requested_at < cutoff]:
+            self._entries.pop(session_id).future.cancel()
+
+    def cancel(self, session_id: str) -> None:
+        """Discard the prefetch of a session, cancelling it if it has not started yet."""
+        with self._lock:
+            self._cancel_trailing(session_id)
+            entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            entry.future.cancel()
+
+    def take(self, session_id: str, text: str) -> Optional[List[Document]]:
+        """
+        Consume the prefetched documents of a session for the submitted text
+
+        Returns:
+            list: The prefetched documents, or None if there is no usable prefetch
+        """
+        with self._lock:
+            # The message is submitted, a deferred draft of it would start too late to help
+            self._cancel_trailing(session_id)
+            entry = self._entries.pop(session_id, None)
+        if entry is None or time.monotonic() - entry.requested_at > self.ttl_seconds:
+            return None
+
+        text = text.strip()
+        if entry.text != text and SequenceMatcher(None, entry.text, text).ratio() < self.similarity:
+            entry.future.cancel()
+            return None
+
+        if not (entry.future.running() or entry.future.done()):
+            # Still queued behind other sessions' prefetches, retrieving now is faster
+            entry.future.cancel()
+            return None
+        try:
+            # Waiting for a prefetch already in flight is still faster than starting over
+            return entry.future.result(timeout=IN_FLIGHT_WAIT_SECONDS)
+        except (TimeoutError, CancelledError):
+            return None
+
+    def stats(self) -> dict:
+        """Return the number of cached and deferred prefetches."""
+        with self._lock:
+            return {"cached_prefetches": len(self._entries), "deferred_prefetches": len(self._trailing)}
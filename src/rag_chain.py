@@ -1,11 +1,15 @@
 import os
+import re
 from dotenv import load_dotenv
 from langchain_xai import ChatXAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.output_parsers import BaseOutputParser
+from langchain_core.messages import BaseMessage
+from langchain_core.output_parsers import BaseOutputParser, BaseTransformOutputParser, StrOutputParser
 from langchain_core.runnables import RunnablePassthrough, RunnableLambda
 from langchain_core.runnables.history import RunnableWithMessageHistory
+from langchain_core.runnables.utils import AddableDict
 from vector_store import init_vector_store
+from article_index import LAW_PATTERN, citation_header
 import warnings
 from langsmith import Client
 
@@ -54,6 +58,147 @@ class LegifAIOutputParser(BaseOutputParser[dict]):
     def _type(self):
         return "legifai_output_parser"
 
+
+# Marker the model uses to introduce the technical summary for the lawyer (turn 2)
+LAWYER_SUMMARY_MARKER = "[RESUMEN TÉCNICO PARA ABOGADO:"
+
+# References to BOE articles, e.g. "artículo 14.2 de la Ley 2/2015" or "BOE-A-2015-11430"
+CITATION_PATTERN = re.compile(
+    r"\b(?:artículos?|articulos?|arts?\.)\s+\d+(?:\.\d+)*(?:\s+(?:bis|ter|quater)\b)?"
+    rf"(?:\s+(?:de\s+la|del)\s+(?:{LAW_PATTERN}))?"
+    r"|\bBOE-[A-Z]-\d{4}-\d+",
+    re.IGNORECASE,
+)
+
+QUESTION_PATTERN = re.compile(r"¿[^¿?]+\?")
+
+# End of a sentence or line, after which citations can no longer grow
+SENTENCE_END_PATTERN = re.compile(r"[.;:!?)\]]\s|\n")
+
+
+def parse_consultation(text, partial=False):
+    """
+    Split a LegifAI answer into typed fields
+
+    Args:
+        text: The (possibly incomplete) model output
+        partial: Whether more text may still follow; only fields that can no longer
+            change are returned for the incomplete tail, and the answer is a prefix of
+            the answer of the full text
+
+    Returns:
+        dict: answer, citations, questions and lawyer_summary; empty fields are omitted
+    """
+    answer = text
+    lawyer_summary = None
+    start = text.find(LAWYER_SUMMARY_MARKER)
+    if start >= 0:
+        end = text.find("]", start)
+        if end >= 0:
+            lawyer_summary = text[start + len(LAWYER_SUMMARY_MARKER):end].strip()
+            answer = text[:start] + text[end + 1:]
+        else:
+            if not partial:
+                lawyer_summary = text[start + len(LAWYER_SUMMARY_MARKER):].strip()
+            answer = text[:start]
+    elif partial:
+        # Hold back a trailing fragment that may turn out to be the summary marker
+        bracket = text.rfind("[")
+        if bracket >= 0 and LAWYER_SUMMARY_MARKER.startswith(text[bracket:]):
+            answer = text[:bracket]
+
+    complete_text = text
+    if partial:
+        sentence_ends = list(SENTENCE_END_PATTERN.finditer(text))
+        complete_text = text[:sentence_ends[-1].start() + 1] if sentence_ends else ""
+
+    citations = []
+    for match in CITATION_PATTERN.finditer(complete_text):
+        citation = " ".join(match.group(0).split())
+        if citation not in citations:
+            citations.append(citation)
+
+    parsed = {
+        # Trailing whitespace of a partial answer is held back until more text follows
+        "answer": answer.strip(),
+        "citations": citations,
+        "questions": [question.strip() for question in QUESTION_PATTERN.findall(answer)],
+        "lawyer_summary": lawyer_summary,
+    }
+    return {key: value for key, value in parsed.items() if value}
+
+
+def _diff_consultation(previous, current):
+    """Return the part of `current` that is new since `previous`, as an addable chunk."""
+    delta = AddableDict()
+    previous_answer = previous.get("answer", "")
+    answer = current.get("answer", "")
+    if answer.startswith(previous_answer) and len(answer) > len(previous_answer):
+        delta["answer"] = answer[len(previous_answer):]
+    for key in ("citations", "questions"):
+        new_items = [item for item in current.get(key, []) if item not in previous.get(key, [])]
+        if new_items:
+            delta[key] = new_items
+    if "lawyer_summary" in current and "lawyer_summary" not in previous:
+        delta["lawyer_summary"] = current["lawyer_summary"]
+    return delta
+
+
+class LegifAIStructuredOutputParser(BaseTransformOutputParser[dict]):
+    """Output parser that splits the response into answer, citations, questions and lawyer summary.
+
+    When streaming, each chunk only holds what is new: answer text as it arrives, and
+    citations, follow-up questions and the lawyer summary as soon as each one is complete.
+    Adding the chunks together gives the same result as parsing the full response.
+    """
+
+    def parse(self, text):
+        """Parse the full output from the language model."""
+        return parse_consultation(text)
+
+    def _chunk_text(self, chunk):
+        if isinstance(chunk, BaseMessage):
+            return chunk.content if isinstance(chunk.content, str) else str(chunk.content)
+        return chunk
+
+    def _next_delta(self, previous, text):
+        """Diff the partial parse of the text received so far against the last one yielded.
+
+        Returns:
+            tuple: The delta to yield (possibly empty) and the parse to diff against next
+        """
+        current = parse_consultation(text, partial=True)
+        delta = _diff_consultation(previous, current)
+        return delta, current if delta else previous
+
+    def _transform(self, input):
+        text = ""
+        previous = {}
+        for chunk in input:
+            text += self._chunk_text(chunk)
+            delta, previous = self._next_delta(previous, text)
+            if delta:
+                yield delta
+        delta = _diff_consultation(previous, parse_consultation(text))
+        if delta:
+            yield delta
+
+    async def _atransform(self, input):
+        text = ""
+        previous = {}
+        async for chunk in input:
+            text += self._chunk_text(chunk)
+            delta, previous = self._next_delta(previous, text)
+            if delta:
+                yield delta
+        delta = _diff_consultation(previous, parse_consultation(text))
+        if delta:
+            yield delta
+
+    @property
+    def _type(self):
+        return "legifai_structured_output_parser"
+
 # System prompt for the chatbot - updated to work with message history
 SYSTEM_PROMPT = """Eres un servicial asesor legal especializado en legislación española. El siguiente contexto incluye extractos de artículos del BOE para ayudar a aconsejar al usuario sobre su consulta legal.
 
@@ -78,6 +223,7 @@ INSTRUCCIONES SEGÚN EL PASO DE LA CONVERSACIÓN:
 DIRECTRICES GENERALES:
 - Sé conciso y ve directamente al grano
 - Menciona los artículos del BOE que apliquen durante la explicación
+- Cada extracto del contexto va precedido de su referencia entre corchetes; úsala para citar el artículo exacto
 - Asume que el usuario sabe que eres un asesor legal competente
 - Usa un tono profesional pero accesible
 
@@ -89,27 +235,110 @@ Historial de conversación:
 
 Consulta actual: {human_input}"""
 
+# Prompt used to fold older turns of a long consultation into a running summary
+SUMMARY_PROMPT = """Eres un asistente que resume consultas legales. Actualiza el resumen existente con los nuevos mensajes de la conversación.
 
-def create_rag_chain_with_history(get_session_history):
-    """
-    Create a RAG chain with message history persistence
+Conserva los hechos del caso, los datos aportados por el usuario, los artículos del BOE mencionados, las preguntas formuladas y cualquier resumen técnico para abogado. Sé conciso y escribe en español.
 
-    Args:
-        get_session_history: Function to get chat history for a session
+Resumen existente:
+{summary}
+
+Nuevos mensajes:
+{conversation}
+
+Resumen actualizado:"""
+
+
+def create_chat_model():
+    """
+    Create the ChatXAI model used by LegifAI
 
     Returns:
-        chain: A LangChain chain with message history that combines retrieval and generation
+        ChatXAI: The grok-3-mini chat model
     """
     # Get the XAI API key from environment variables
     xai_api_key = os.getenv('XAI_API_KEY')
     if not xai_api_key:
         raise ValueError("XAI API key must be set")
 
+    return ChatXAI(xai_api_key=xai_api_key, model="grok-3-mini")
+
+
+def create_history_summarizer():
+    """
+    Create the chain that summarizes older turns of a conversation
+
+    Returns:
+        chain: A LangChain chain mapping the previous summary and new messages to an updated summary
+    """
+    prompt = ChatPromptTemplate.from_template(SUMMARY_PROMPT)
+    return prompt | create_chat_model() | StrOutputParser()
+
+
+def format_docs(docs, article_index=None):
+    """Join retrieved documents, each preceded by its citation header, into the prompt context."""
+    formatted = []
+    for doc in docs:
+        if article_index is not None:
+            header = article_index.header(doc)
+        else:
+            header = citation_header(doc.metadata, doc.page_content)
+        formatted.append(f"[{header}]\n{doc.page_content}")
+    return "\n\n".join(formatted)
+
+
+def create_context_retriever(retriever=None, article_index=None, prefetch_cache=None):
+    """
+    Create the runnable that retrieves and formats the prompt context for an input
+
+    Args:
+        retriever: Optional retriever to use, initialized from Pinecone if not given
+        article_index: Optional ArticleIndex used to resolve exact article references
+            without a vector search
+        prefetch_cache: Optional PrefetchCache holding documents retrieved while the
+            user was typing
+
+    Returns:
+        RunnableLambda: Maps the chain inputs to the context string
+    """
     # Initialize the retriever from Pinecone
-    retriever = init_vector_store()
+    if retriever is None:
+        retriever = init_vector_store()
+
+    # Function to retrieve documents based on the human input
+    def retrieve(inputs, session_id):
+        if article_index is not None:
+            # Exact article references skip the embedding and vector search
+            docs = article_index.lookup(inputs["human_input"], inputs.get("history", []))
+            if docs:
+                return docs
+        if prefetch_cache is not None and session_id:
+            # Reuse the documents retrieved while the message was being typed
+            docs = prefetch_cache.take(session_id, inputs["human_input"])
+            if docs is not None:
+                return docs
+        return retriever.invoke(inputs["human_input"])
+
+    # Function to retrieve context based on the human input
+    def get_context(inputs, config):
+        # Batch runs retrieve the documents for many inputs up front
+        docs = inputs.get("docs")
+        if docs is None:
+            docs = retrieve(inputs, config.get("configurable", {}).get("session_id"))
+        return format_docs(docs, article_index)
 
+    return RunnableLambda(get_context)
+
+
+def create_generation_chain():
+    """
+    Create the chain that answers from the context, history and human input
+
+    Returns:
+        chain: A LangChain chain mapping `context`, `history` and `human_input` to the model message
+    """
     # Initialize the ChatXAI model
-    model = ChatXAI(xai_api_key=xai_api_key, model="grok-3-mini")
+    model = create_chat_model()
 
     # Create the prompt template with message history
     prompt = ChatPromptTemplate.from_messages([
@@ -118,19 +347,52 @@ def create_rag_chain_with_history(get_session_history):
         ("human", "{human_input}")
     ])
 
-    # Function to retrieve context based on the human input
-    def get_context(inputs):
-        docs = retriever.invoke(inputs["human_input"])
-        return "\n\n".join([doc.page_content for doc in docs])
+    return prompt | model
+
+
+def create_rag_chain_with_history(
+    get_session_history,
+    retriever=None,
+    structured=False,
+    article_index=None,
+    prefetch_cache=None,
+):
+    """
+    Create a RAG chain with message history persistence
+
+    Args:
+        get_session_history: Function to get chat history for a session
+        retriever: Optional retriever to use, initialized from Pinecone if not given
+        structured: Whether to return typed fields (answer, citations, questions,
+            lawyer summary) instead of the raw response text
+        article_index: Optional ArticleIndex used to resolve exact article references
+            without a vector search
+        prefetch_cache: Optional PrefetchCache holding documents retrieved while the
+            user was typing
+
+    Returns:
+        chain: A LangChain chain with message history that combines retrieval and generation
+    """
+    context_retriever = create_context_retriever(retriever, article_index, prefetch_cache)
 
-    # Create the RAG chain with custom output parser
     rag_chain = (
-        RunnablePassthrough.assign(context=RunnableLambda(get_context))
-        | prompt
-        | model
-        | LegifAIOutputParser()
+        RunnablePassthrough.assign(context=context_retriever)
+        | create_generation_chain()
     )
 
+    if structured:
+        # The full model message is stored in the history and parsed afterwards,
+        # so the parser can stream typed fields as they complete
+        return RunnableWithMessageHistory(
+            rag_chain,
+            get_session_history,
+            input_messages_key="human_input",
+            history_messages_key="history",
+        ) | LegifAIStructuredOutputParser()
+
+    # Add the custom output parser
+    rag_chain = rag_chain | LegifAIOutputParser()
+
     # Wrap with message history
     chain_with_history = RunnableWithMessageHistory(
         rag_chain,
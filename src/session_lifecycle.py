@@ -0,0 +1,311 @@
+"""Lifecycle management for LegifAI chat sessions.
+
+Idle or closed sessions are moved out of the live `chat_histories` directory into
+append-only, gzip-compressed JSONL segment files. Every archived session is written
+as its own gzip member, and a SQLite index maps the session ID to its segment, byte
+offset and length, so an archived session can be read back (or restored) with a
+single keyed lookup however many sessions have been archived.
+
+Restoring a session removes it from the index, leaving a dead copy in its segment.
+Segments whose dead bytes pass a threshold are compacted by the background sweeper.
+"""
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+from history_compaction import get_session_lock
+
+# Lifecycle settings, overridable from the environment
+DEFAULT_IDLE_TTL_SECONDS = int(os.getenv('SESSION_IDLE_TTL_SECONDS', str(24 * 60 * 60)))
+DEFAULT_SWEEP_INTERVAL_SECONDS = int(os.getenv('SESSION_SWEEP_INTERVAL_SECONDS', '600'))
+DEFAULT_SEGMENT_MAX_BYTES = int(os.getenv('SESSION_SEGMENT_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Share of dead bytes in a segment above which the sweeper rewrites it
+DEFAULT_COMPACT_DEAD_RATIO = float(os.getenv('SESSION_SEGMENT_COMPACT_RATIO', '0.5'))
+
+
+class SessionArchive:
+    """Compressed segment files of archived sessions, indexed by session ID."""
+
+    def __init__(self, archive_dir: Union[str, Path], segment_max_bytes: int = DEFAULT_SEGMENT_MAX_BYTES):
+        self.archive_dir = Path(archive_dir)
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        self.segment_max_bytes = segment_max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.archive_dir / "index.sqlite3"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, segment TEXT NOT NULL, offset INTEGER NOT NULL, "
+            "length INTEGER NOT NULL, messages INTEGER NOT NULL, archived_at REAL NOT NULL)"
+        )
+        self._db.commit()
+        self._segment = self._latest_segment()
+
+    def _latest_segment(self) -> Path:
+        segments = sorted(self.archive_dir.glob("segment-*.jsonl.gz"))
+        if segments:
+            return segments[-1]
+        return self.archive_dir / "segment-000001.jsonl.gz"
+
+    def _writable_segment(self) -> Path:
+        """Return the current segment, rolling over to a new one once it is full."""
+        if self._segment.exists() and self._segment.stat().st_size >= self.segment_max_bytes:
+            number = int(self._segment.name.split("-")[1].split(".")[0]) + 1
+            self._segment = self.archive_dir / f"segment-{number:06d}.jsonl.gz"
+        return self._segment
+
+    def archive(self, session_id: str, record: dict) -> None:
+        """Append a session record to the current segment and index it."""
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        member = gzip.compress(line.encode("utf-8"))
+        with self._lock:
+            segment = self._writable_segment()
+            with open(segment, "ab") as f:
+                offset = f.tell()
+                f.write(member)
+                f.flush()
+                os.fsync(f.fileno())
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, segment.name, offset, len(member), len(record.get("messages", [])), time.time()),
+            )
+            self._db.commit()
+
+    def load(self, session_id: str) -> Optional[dict]:
+        """Read an archived session record, or None if the session was never archived."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT segment, offset, length FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            segment, offset, length = row
+            # Read under the lock, compaction may be moving the record
+            with open(self.archive_dir / segment, "rb") as f:
+                f.seek(offset)
+                member = f.read(length)
+        return json.loads(gzip.decompress(member).decode("utf-8"))
+
+    def delete(self, session_id: str) -> None:
+        """Drop a session from the index; its bytes stay dead until the segment is compacted."""
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._db.commit()
+
+    def _live_bytes(self) -> dict:
+        """Return the bytes of indexed records per segment. Must be called with the lock held."""
+        return dict(self._db.execute("SELECT segment, SUM(length) FROM sessions GROUP BY segment").fetchall())
+
+    def compact(self, dead_ratio: float = DEFAULT_COMPACT_DEAD_RATIO) -> int:
+        """
+        Rewrite the segments whose share of dead bytes exceeds `dead_ratio`
+
+        Returns:
+            int: The number of bytes reclaimed
+        """
+        reclaimed = 0
+        with self._lock:
+            live_bytes = self._live_bytes()
+            for segment in sorted(self.archive_dir.glob("segment-*.jsonl.gz")):
+                size = segment.stat().st_size
+                live = live_bytes.get(segment.name, 0)
+                if size == 0 or (size - live) / size <= dead_ratio:
+                    continue
+                rows = self._db.execute(
+                    "SELECT session_id, offset, length FROM sessions WHERE segment = ? ORDER BY offset",
+                    (segment.name,),
+                ).fetchall()
+                if not rows and segment != self._segment:
+                    segment.unlink()
+                    reclaimed += size
+                    continue
+                tmp_path = segment.with_suffix(".tmp")
+                moved = []
+                with open(segment, "rb") as source, open(tmp_path, "wb") as target:
+                    for session_id, offset, length in rows:
+                        source.seek(offset)
+                        moved.append((target.tell(), session_id))
+                        target.write(source.read(length))
+                    target.flush()
+                    os.fsync(target.fileno())
+                tmp_path.replace(segment)
+                self._db.executemany("UPDATE sessions SET offset = ? WHERE session_id = ?", moved)
+                self._db.commit()
+                reclaimed += size - live
+        return reclaimed
+
+    def stats(self) -> dict:
+        """Return the number of archived sessions and the size of the segment files."""
+        with self._lock:
+            sessions, messages = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(messages), 0) FROM sessions"
+            ).fetchone()
+            live_bytes = sum(self._live_bytes().values())
+        segments = list(self.archive_dir.glob("segment-*.jsonl.gz"))
+        segment_bytes = sum(segment.stat().st_size for segment in segments)
+        return {
+            "archived_sessions": sessions,
+            "archived_messages": messages,
+            "segments": len(segments),
+            "segment_bytes": segment_bytes,
+            "dead_segment_bytes": segment_bytes - live_bytes,
+        }
+
+
+class SessionLifecycleManager:
+    """Archives idle and closed sessions and restores them on demand."""
+
+    def __init__(
+        self,
+        history_dir: Union[str, Path],
+        archive: SessionArchive,
+        idle_ttl_seconds: int = DEFAULT_IDLE_TTL_SECONDS,
+        sweep_interval_seconds: int = DEFAULT_SWEEP_INTERVAL_SECONDS,
+    ):
+        """
+        Args:
+            history_dir: Directory holding the live chat histories
+            archive: Archive that idle and closed sessions are moved into
+            idle_ttl_seconds: Time without activity after which a session is archived
+            sweep_interval_seconds: Time between two sweeps of the history directory
+        """
+        self.history_dir = Path(history_dir)
+        self.archive = archive
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self.last_sweep = {}
+        self._stop = threading.Event()
+        self._sweeper = None
+
+    def _history_paths(self, session_id: str):
+        return self.history_dir / f"{session_id}.json", self.history_dir / f"{session_id}.state.json"
+
+    def archive_session(self, session_id: str, reason: str = "closed") -> bool:
+        """Move a live session into the archive.
+
+        Returns:
+            True if the session was archived, False if it had no live history
+        """
+        history_path, state_path = self._history_paths(session_id)
+        with get_session_lock(session_id):
+            if not history_path.exists():
+                return False
+            messages = json.loads(history_path.read_text())
+            state = json.loads(state_path.read_text()) if state_path.exists() else {}
+            if not messages and not state:
+                # Nothing worth keeping, e.g. a consultation that was never started
+                history_path.unlink()
+                return False
+            self.archive.archive(session_id, {
+                "session_id": session_id,
+                "reason": reason,
+                "last_activity": history_path.stat().st_mtime,
+                "messages": messages,
+                "state": state,
+            })
+            history_path.unlink()
+            if state_path.exists():
+                state_path.unlink()
+        return True
+
+    def restore_session(self, session_id: str) -> bool:
+        """Bring an archived session back into the live directory if it is not live already.
+
+        Returns:
+            True if the session was restored from the archive
+        """
+        history_path, state_path = self._history_paths(session_id)
+        if history_path.exists():
+            return False
+        record = self.archive.load(session_id)
+        if record is None:
+            return False
+        with get_session_lock(session_id):
+            if history_path.exists():
+                return False
+            if record["state"]:
+                state_path.write_text(json.dumps(record["state"]))
+            history_path.write_text(json.dumps(record["messages"]))
+            # The session is live again, its archived copy is now dead
+            self.archive.delete(session_id)
+        return True
+
+    def sweep(self) -> int:
+        """Archive every live session that has been idle for longer than the TTL.
+
+        Returns:
+            The number of archived sessions
+        """
+        started = time.time()
+        cutoff = started - self.idle_ttl_seconds
+        scanned = 0
+        archived = 0
+        with os.scandir(self.history_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".json") or entry.name.endswith(".state.json"):
+                    continue
+                scanned += 1
+                try:
+                    if entry.stat().st_mtime >= cutoff:
+                        continue
+                    if self.archive_session(entry.name[:-len(".json")], reason="idle"):
+                        archived += 1
+                except (OSError, ValueError) as e:
+                    print(f"Warning: Could not archive session file {entry.name}: {e}")
+        self.last_sweep = {
+            "finished_at": time.time(),
+            "duration_seconds": round(time.time() - started, 3),
+            "scanned_sessions": scanned,
+            "archived_sessions": archived,
+        }
+        return archived
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.sweep_interval_seconds):
+            try:
+                archived = self.sweep()
+                if archived:
+                    print(f"Session sweeper archived {archived} idle sessions")
+                reclaimed = self.archive.compact()
+                if reclaimed:
+                    print(f"Session sweeper reclaimed {reclaimed} bytes of archive segments")
+            except Exception as e:
+                print(f"Warning: Session sweep failed: {e}")
+
+    def start(self) -> None:
+        """Start the background sweeper thread."""
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+        self._stop.clear()
+        self._sweeper = threading.Thread(target=self._run, name="session-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop(self) -> None:
+        """Stop the background sweeper thread."""
+        self._stop.set()
+
+    def stats(self) -> dict:
+        """Return statistics about live and archived sessions."""
+        live_sessions = 0
+        live_bytes = 0
+        with os.scandir(self.history_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(".json"):
+                    live_bytes += entry.stat().st_size
+                    if not entry.name.endswith(".state.json"):
+                        live_sessions += 1
+        return {
+            "live_sessions": live_sessions,
+            "live_bytes": live_bytes,
+            "idle_ttl_seconds": self.idle_ttl_seconds,
+            "sweep_interval_seconds": self.sweep_interval_seconds,
+            "last_sweep": self.last_sweep,
+            **self.archive.stats(),
+        }
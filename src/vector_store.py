@@ -1,4 +1,5 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from pinecone import Pinecone
 from langchain_pinecone import PineconeVectorStore
@@ -10,6 +11,9 @@ load_dotenv()
 def init_vector_store():
     """
     Initialize the Pinecone vector store and create a retriever
+
+    With RETRIEVAL_MODE=two_stage, a TwoStageRetriever over the local Matryoshka
+    index is returned instead.
     
     Returns:
         VectorStoreRetriever: A retriever for the Pinecone vector store
@@ -35,6 +39,18 @@ def init_vector_store():
         api_key=openai_api_key
     )
     
+    # Two-stage mode: coarse search over truncated local vectors, rescored with the full ones
+    if os.getenv('RETRIEVAL_MODE', 'pinecone') == 'two_stage':
+        # Imported here so numpy is only needed in two-stage mode
+        from matryoshka_index import MatryoshkaIndex, TwoStageRetriever, DEFAULT_CANDIDATES, DEFAULT_INDEX_DIR
+
+        return TwoStageRetriever(
+            index=MatryoshkaIndex.load(DEFAULT_INDEX_DIR),
+            embeddings=embeddings,
+            k=5,
+            candidates=DEFAULT_CANDIDATES,
+        )
+
     # Get the Pinecone index
     try:
         index = pc.Index(pinecone_index_name)
@@ -51,4 +67,33 @@ def init_vector_store():
         search_kwargs={"k": 5}  # Retrieve top 5 most similar documents
     )
     
-    return retriever 
\ No newline at end of file
+    return retriever
+
+
+def retrieve_batch(retriever, queries):
+    """
+    Retrieve documents for several queries at once
+
+    All queries are embedded with a single embeddings request and the Pinecone
+    searches run concurrently (or locally, in two-stage mode).
+
+    Args:
+        retriever: The retriever returned by init_vector_store
+        queries: The queries to retrieve documents for
+
+    Returns:
+        list: One list of documents per query, in the same order as the queries
+    """
+    if not queries:
+        return []
+
+    if hasattr(retriever, "search_by_vector"):  # TwoStageRetriever
+        vectors = retriever.embeddings.embed_documents(list(queries))
+        return [retriever.search_by_vector(vector) for vector in vectors]
+
+    vector_store = retriever.vectorstore
+    k = retriever.search_kwargs.get("k", 4)
+    vectors = vector_store.embeddings.embed_documents(list(queries))
+
+    with ThreadPoolExecutor(max_workers=min(8, len(vectors))) as executor:
+        return list(executor.map(lambda vector: vector_store.similarity_search_by_vector(vector, k=k), vectors))
@@ -0,0 +1,74 @@
+"""Tests for exact article lookups through the local article index."""
+from langchain_core.messages import HumanMessage
+
+from article_index import ArticleIndex, build_from_chunks
+
+CHUNK = (
+    "Artículo 19. Escritura de constitución.\n"
+    "1. La escritura se otorga por todos los socios.\n"
+    "2. Los socios firman ante notario.\n"
+    "Artículo 20. Contenido de la escritura.\n"
+    "La escritura contendrá la identidad de los socios.\n"
+)
+
+
+def build_index():
+    return build_from_chunks([
+        ("ley-1-2010-chunk-7", CHUNK, {"law": "Ley 1/2010"}),
+        ("codigo-civil-chunk-3", "Artículo 20. Del nacimiento.\nEl nacimiento determina la personalidad.\n",
+         {"title": "Código Civil"}),
+    ])
+
+
+def test_build_stores_article_and_section_spans():
+    index = build_index()
+    chunk_id, start, end = index.entries["ley 1/2010|19"][0]
+    assert chunk_id == "ley-1-2010-chunk-7"
+    assert CHUNK[start:end].startswith("Artículo 19.")
+    assert "Artículo 20" not in CHUNK[start:end]
+    _, start, end = index.entries["ley 1/2010|19|2"][0]
+    assert CHUNK[start:end] == "2. Los socios firman ante notario.\n"
+    assert index.chunks["ley-1-2010-chunk-7"]["header"] == "Ley 1/2010, arts. 19, 20"
+
+
+def test_lookup_article_returns_only_that_article():
+    docs = build_index().lookup("¿Qué dice el artículo 19 de la Ley 1/2010?")
+    assert len(docs) == 1
+    assert docs[0].page_content.startswith("Artículo 19.")
+    assert "Artículo 20" not in docs[0].page_content
+    assert docs[0].metadata["citation"] == "Ley 1/2010, art. 19"
+
+
+def test_lookup_section_cites_the_section():
+    docs = build_index().lookup("art. 19.2 de la Ley 1/2010")
+    assert docs[0].page_content == "2. Los socios firman ante notario.\n"
+    assert docs[0].metadata["citation"] == "Ley 1/2010, art. 19.2"
+
+
+def test_lookup_unnumbered_section_falls_back_to_article():
+    docs = build_index().lookup("artículo 20.3 de la Ley 1/2010")
+    assert docs[0].page_content.startswith("Artículo 20.")
+    assert docs[0].metadata["citation"] == "Ley 1/2010, art. 20"
+
+
+def test_lookup_resolves_law_from_history():
+    index = build_index()
+    # Article 20 exists in two laws, the conversation says which one
+    assert index.lookup("¿y el artículo 20?") == []
+    history = [HumanMessage(content="Tengo dudas sobre la Ley 1/2010")]
+    docs = index.lookup("¿y el artículo 20?", history)
+    assert docs[0].metadata["citation"] == "Ley 1/2010, art. 20"
+
+
+def test_lookup_unknown_reference_falls_back_to_vector_search():
+    assert build_index().lookup("artículo 99 de la Ley 1/2010") == []
+    assert build_index().lookup("¿Cómo registro una marca?") == []
+
+
+def test_index_round_trip(tmp_path):
+    index = build_index()
+    path = tmp_path / "article_index.json"
+    index.save(str(path))
+    loaded = ArticleIndex.load(str(path))
+    assert loaded.entries == index.entries
+    assert loaded.lookup("art. 19.2 de la Ley 1/2010")[0].metadata["citation"] == "Ley 1/2010, art. 19.2"
@@ -0,0 +1,58 @@
+"""Tests for the structured output contract of the /chat/structured endpoint."""
+import pytest
+
+from rag_chain import LegifAIStructuredOutputParser, parse_consultation
+
+FIRST_TURN = (
+    "\nSegún el artículo 19 de la Ley 1/2010 y el art. 5 bis del Código Civil, necesita una escritura.\n"
+    "¿Cuántos socios tendrá la sociedad? ¿Qué capital aportarán?\n"
+)
+
+SECOND_TURN = (
+    "Me haré cargo de su caso. [RESUMEN TÉCNICO PARA ABOGADO: constitución de SL, "
+    "artículo 19 de la Ley 1/2010, dos socios.] "
+)
+
+
+def test_parse_first_turn():
+    parsed = parse_consultation(FIRST_TURN)
+    assert parsed["answer"] == FIRST_TURN.strip()
+    assert parsed["citations"] == ["artículo 19 de la Ley 1/2010", "art. 5 bis del Código Civil"]
+    assert parsed["questions"] == ["¿Cuántos socios tendrá la sociedad?", "¿Qué capital aportarán?"]
+    assert "lawyer_summary" not in parsed
+
+
+def test_parse_second_turn_splits_lawyer_summary():
+    parsed = parse_consultation(SECOND_TURN)
+    assert parsed["answer"] == "Me haré cargo de su caso."
+    assert parsed["lawyer_summary"] == "constitución de SL, artículo 19 de la Ley 1/2010, dos socios."
+    assert parsed["citations"] == ["artículo 19 de la Ley 1/2010"]
+    assert "questions" not in parsed
+
+
+def test_parse_unterminated_lawyer_summary():
+    parsed = parse_consultation("Me haré cargo de su caso. [RESUMEN TÉCNICO PARA ABOGADO: despido")
+    assert parsed["answer"] == "Me haré cargo de su caso."
+    assert parsed["lawyer_summary"] == "despido"
+
+
+def test_parse_omits_empty_fields():
+    assert parse_consultation("  ") == {}
+
+
+def test_partial_parse_holds_back_incomplete_fields():
+    parsed = parse_consultation("Según el artículo 19 de la Ley 1/2010 y el art", partial=True)
+    assert "citations" not in parsed
+    parsed = parse_consultation("Me haré cargo. [RESUMEN TÉC", partial=True)
+    assert parsed["answer"] == "Me haré cargo."
+    assert "lawyer_summary" not in parsed
+
+
+@pytest.mark.parametrize("text", [FIRST_TURN, SECOND_TURN])
+@pytest.mark.parametrize("chunk_size", [1, 3, 17])
+def test_streamed_chunks_add_up_to_full_parse(text, chunk_size):
+    chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+    streamed = None
+    for delta in LegifAIStructuredOutputParser().transform(iter(chunks)):
+        streamed = delta if streamed is None else streamed + delta
+    assert dict(streamed) == parse_consultation(text)